@@ -1,79 +1,111 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import os
+import hmac
 import asyncio
-from flask import Flask, request
+import logging
+from contextlib import asynccontextmanager
+from datetime import timedelta
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
 from telegram import Update
-from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, filters
-)
-from handlers import (
-    start, register_name, register_university, register_age, register_gender,
-    uni_selection_callback, register_interests, register_bio, register_photo,
-    profile, browse, browse_response, matches, start_chat_callback, relay_chat_message, stop_chat
-)
-from confession import get_confess_conv_handler
+from bot import build_application, start_services, stop_services
 from db import init_db
+from persistence import DatabasePersistence
+from config import PERSISTENCE_INTERVAL, CONVERSATION_TIMEOUT, USER_DATA_TTL_DAYS, PERSISTENCE_SHARED
+import metrics
+
+logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 TOKEN = os.environ["BOT_TOKEN"]
 WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "unimatch-ethio-2f6e3d4c7b9a4e2f8b1c")
 RENDER_EXTERNAL_URL = os.environ.get("RENDER_EXTERNAL_URL", "https://makabot.onrender.com")
+PORT = int(os.environ.get("PORT", "10000"))
+# Number of updates processed in parallel by the Application
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", "64"))
+# Set to 0 once migrate.py runs at deploy time; startup then skips schema checks
+AUTO_MIGRATE = os.environ.get("AUTO_MIGRATE", "1") == "1"
 
-app = Flask(__name__)
-init_db()
+# Built in the lifespan: nothing talks to the database or the Bot API at import
+telegram_app = None
+timings = {"import": time.perf_counter() - IMPORT_STARTED, "startup": 0.0, "first_update": 0.0}
+metrics.Gauge("bot_import_seconds", "Time spent importing app.py", lambda: timings["import"])
+metrics.Gauge("bot_startup_seconds", "Time from import until the webhook was served", lambda: timings["startup"])
+metrics.Gauge(
+    "bot_first_update_seconds", "Time from import until the first update arrived", lambda: timings["first_update"]
+)
 
-telegram_app = ApplicationBuilder().token(TOKEN).build()
+async def webhook(request: Request):
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        return Response(status_code=403)
+    if not timings["first_update"]:
+        timings["first_update"] = time.perf_counter() - IMPORT_STARTED
+        logger.info("First update %.2fs after start", timings["first_update"])
+    update = Update.de_json(await request.json(), telegram_app.bot)
+    # Acknowledge immediately; the Application drains the queue concurrently
+    await telegram_app.submit(update)
+    return Response()
 
-(NAME, UNIVERSITY, AGE, GENDER, INTERESTS, BIO, PHOTO, SELECT_UNIS) = range(8)
-reg_conv = ConversationHandler(
-    entry_points=[CommandHandler('start', start)],
-    states={
-        NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_name)],
-        UNIVERSITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_university)],
-        AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_age)],
-        GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_gender)],
-        SELECT_UNIS: [CallbackQueryHandler(uni_selection_callback)],
-        INTERESTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_interests)],
-        BIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_bio)],
-        PHOTO: [MessageHandler(filters.PHOTO, register_photo)],
-    },
-    fallbacks=[],
-)
-telegram_app.add_handler(reg_conv)
-telegram_app.add_handler(CommandHandler('profile', profile))
-telegram_app.add_handler(CommandHandler('browse', browse))
-telegram_app.add_handler(MessageHandler(filters.Regex(r"^(👍 Like|⏭️ Skip)$"), browse_response))
-telegram_app.add_handler(CommandHandler('matches', matches))
-telegram_app.add_handler(CallbackQueryHandler(start_chat_callback, pattern="^chatwith_"))
-telegram_app.add_handler(CommandHandler('stopchat', stop_chat))
-telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, relay_chat_message))
-telegram_app.add_handler(MessageHandler(filters.PHOTO, relay_chat_message))
-telegram_app.add_handler(get_confess_conv_handler())
+async def index(request: Request):
+    return PlainTextResponse("Unimatch Ethio bot is running!")
+
+async def prometheus_metrics(request: Request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-@app.route(f"/{WEBHOOK_SECRET}", methods=["POST"])
-def webhook():
-    update = Update.de_json(request.get_json(force=True), telegram_app.bot)
-    try:
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            asyncio.ensure_future(telegram_app.update_queue.put(update))
-        else:
-            loop.run_until_complete(telegram_app.update_queue.put(update))
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(telegram_app.update_queue.put(update))
-    return "OK"
+async def setup_webhook():
+    # setWebhook only when the registered one differs, instead of on every boot
+    webhook_url = f"{RENDER_EXTERNAL_URL}/{WEBHOOK_SECRET}"
+    info = await telegram_app.bot.get_webhook_info()
+    if info.url == webhook_url and set(info.allowed_updates or ()) == set(Update.ALL_TYPES):
+        return
+    # chat_member updates are opt-in; they keep the membership cache fresh
+    await telegram_app.bot.set_webhook(
+        url=webhook_url, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES
+    )
+    logger.info("Webhook set to %s", RENDER_EXTERNAL_URL)
 
-@app.route("/", methods=["GET"])
-def index():
-    return "Unimatch Ethio bot is running!"
+@asynccontextmanager
+async def lifespan(_):
+    global telegram_app
+    started = time.perf_counter()
+    if AUTO_MIGRATE:
+        init_db()
+    migrated = time.perf_counter()
+    persistence = DatabasePersistence(
+        PERSISTENCE_INTERVAL, timedelta(seconds=CONVERSATION_TIMEOUT), timedelta(days=USER_DATA_TTL_DAYS),
+        PERSISTENCE_SHARED
+    )
+    if PERSISTENCE_SHARED:
+        logger.warning("PERSISTENCE_SHARED is set: conversations in progress are not shared between workers")
+    telegram_app = build_application(TOKEN, CONCURRENT_UPDATES, persistence=persistence)
+    # The Application runs on the same event loop as the web server
+    async with telegram_app:
+        # DB-backed services and the Bot API round trip don't depend on each other
+        await asyncio.gather(start_services(telegram_app), setup_webhook())
+        await telegram_app.start()
+        timings["startup"] = time.perf_counter() - IMPORT_STARTED
+        logger.info(
+            "Ready in %.2fs (import %.2fs, migrate %.2fs, initialize %.2fs)",
+            timings["startup"], timings["import"], migrated - started, time.perf_counter() - migrated
+        )
+        yield
+        await telegram_app.stop()
+        await stop_services(telegram_app)
+
+app = Starlette(
+    routes=[
+        Route(f"/{WEBHOOK_SECRET}", webhook, methods=["POST"]),
+        Route("/", index, methods=["GET"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
 
 if __name__ == "__main__":
-    import telegram
-    async def setup_webhook():
-        bot = telegram.Bot(token=TOKEN)
-        webhook_url = f"{RENDER_EXTERNAL_URL}/{WEBHOOK_SECRET}"
-        await bot.delete_webhook()
-        await bot.set_webhook(url=webhook_url)
-    asyncio.run(setup_webhook())
-    app.run(host="0.0.0.0", port=10000)
+    uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -0,0 +1,283 @@
+# bench.py
+# Load-test harness. Builds the same Application as app.py, points it at a
+# local database and a stub Bot API, and replays synthetic users who
+# register, swipe, chat and confess concurrently.
+#
+#   python bench.py --users 200 --swipes 20 --messages 5 --api-latency 0.03 --flood-rate 0.01
+#
+# Uses a throwaway SQLite file unless --db-url is given. Tables are created
+# if missing, but never dropped, so use a scratch database with --db-url.
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import BaseRequest
+
+from metrics import current_handler, iter_handlers
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay synthetic traffic through the bot handlers")
+    parser.add_argument("--users", type=int, default=100, help="concurrent synthetic users")
+    parser.add_argument("--swipes", type=int, default=20, help="Like/Skip taps per user")
+    parser.add_argument("--messages", type=int, default=5, help="chat messages per user")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="mean stub Bot API latency (s)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument("--db-url", default=None, help="database URL (default: temporary SQLite file)")
+    parser.add_argument("--flood-control", action="store_true",
+                        help="keep the per-user flood guard on (synthetic users tap far faster than people)")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.api_calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.updates = 0
+        self.floods = 0
+
+class StubBotAPI(BaseRequest):
+    # Answers Bot API calls locally with plausible payloads
+    def __init__(self, stats, latency, flood_rate):
+        self.stats = stats
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.stats.api_calls[current_handler.get()] += 1
+        if self.latency:
+            await asyncio.sleep(random.expovariate(1 / self.latency))
+        if endpoint.startswith("send") and random.random() < self.flood_rate:
+            self.stats.floods += 1
+            body = {
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }
+            return 429, json.dumps(body).encode()
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if endpoint == "getChatMember":
+            user = {"id": params["user_id"], "is_bot": False, "first_name": "user"}
+            return {"status": "member", "user": user}
+        if endpoint.startswith("send") or endpoint.startswith("edit"):
+            chat_id = params.get("chat_id", 0)
+            if isinstance(chat_id, str):
+                chat = {"id": -1001, "type": "channel", "username": chat_id.lstrip("@")}
+            else:
+                chat = {"id": chat_id, "type": "private"}
+            return {
+                "message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": chat, "text": params.get("text", ""),
+            }
+        return True
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _user(uid):
+        return {"id": uid, "is_bot": False, "first_name": f"user{uid}"}
+
+    def _message(self, uid, **fields):
+        message = {
+            "message_id": next(self._ids), "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"}, "from": self._user(uid),
+        }
+        message.update(fields)
+        return message
+
+    def text(self, uid, text):
+        fields = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return Update.de_json({"update_id": next(self._ids), "message": self._message(uid, **fields)}, self.bot)
+
+    def photo(self, uid):
+        photo = [{"file_id": f"photo-{uid}", "file_unique_id": f"p{uid}", "width": 640, "height": 640}]
+        return Update.de_json({"update_id": next(self._ids), "message": self._message(uid, photo=photo)}, self.bot)
+
+    def callback(self, uid, data):
+        query = {
+            "id": str(next(self._ids)), "from": self._user(uid), "chat_instance": str(uid),
+            "data": data, "message": self._message(uid, text="keyboard"),
+        }
+        return Update.de_json({"update_id": next(self._ids), "callback_query": query}, self.bot)
+
+def time_handlers(application, stats):
+    # Keeps raw latency samples for percentiles; the instrumentation installed
+    # by build_application() attributes queries and API calls to the handler
+    for handler in iter_handlers(application):
+        handler.callback = timed(handler.callback, stats)
+
+def timed(callback, stats):
+    name = callback.__name__
+
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            stats.errors[name] += 1
+            raise
+        finally:
+            stats.latencies[name].append(time.perf_counter() - started)
+    wrapper.__name__ = name
+    return wrapper
+
+async def ignore_error(update, context):
+    pass
+
+class Gate:
+    # Lets every user finish one phase before any starts the next
+    def __init__(self, parties):
+        self.parties = parties
+        self.arrived = 0
+        self.event = asyncio.Event()
+
+    async def wait(self):
+        self.arrived += 1
+        if self.arrived >= self.parties:
+            self.event.set()
+        await self.event.wait()
+
+async def run_user(application, updates, stats, uid, gender, partner, args, registered, paired, universities):
+    async def send(update):
+        stats.updates += 1
+        if application.admit is not None and not application.admit(update):
+            return
+        await application.process_update(update)
+
+    await send(updates.text(uid, "/start"))
+    await send(updates.text(uid, f"User {uid}"))
+    await send(updates.text(uid, random.choice(universities)))
+    await send(updates.text(uid, str(random.randint(18, 30))))
+    await send(updates.text(uid, gender))
+    await send(updates.callback(uid, "All Universities"))
+    await send(updates.callback(uid, "__done__"))
+    await send(updates.text(uid, "music, football, coding"))
+    await send(updates.text(uid, "Benchmark user"))
+    await send(updates.photo(uid))
+    await registered.wait()
+
+    await send(updates.text(uid, "/browse"))
+    for _ in range(args.swipes):
+        await send(updates.text(uid, random.choice(["👍 Like", "⏭️ Skip"])))
+    await send(updates.text(uid, "/matches"))
+    if partner is not None:
+        await send(updates.callback(uid, f"chatwith_{partner}"))
+    await paired.wait()
+
+    for i in range(args.messages):
+        await send(updates.text(uid, f"message {i}"))
+    await send(updates.text(uid, "/stopchat"))
+    await send(updates.text(uid, "/confess"))
+    await send(updates.text(uid, f"Benchmark confession {uid}"))
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def report(stats, elapsed):
+    print(f"\n{'handler':<26}{'calls':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'db/call':>9}{'api/call':>9}{'errors':>8}")
+    for name in sorted(stats.latencies, key=lambda n: -statistics.fmean(stats.latencies[n])):
+        samples = stats.latencies[name]
+        print(
+            f"{name:<26}{len(samples):>7}"
+            f"{percentile(samples, 50) * 1000:>9.1f}{percentile(samples, 95) * 1000:>9.1f}"
+            f"{percentile(samples, 99) * 1000:>9.1f}"
+            f"{stats.queries[name] / len(samples):>9.2f}{stats.api_calls[name] / len(samples):>9.2f}"
+            f"{stats.errors[name]:>8}"
+        )
+    total_queries = sum(stats.queries.values())
+    total_calls = sum(stats.api_calls.values())
+    print(f"\nupdates: {stats.updates} in {elapsed:.2f}s ({stats.updates / elapsed:.1f} updates/s)")
+    print(f"db queries/update: {total_queries / stats.updates:.2f} "
+          f"(outside handlers: {stats.queries['(background)']})")
+    print(f"api calls/update: {total_calls / stats.updates:.2f} "
+          f"(outside handlers: {stats.api_calls['(background)']}, simulated 429s: {stats.floods})")
+
+async def run(args):
+    # Imported late so DATABASE_URL is set before db.py reads it
+    from sqlalchemy import event
+    import db
+    from bot import build_application, start_services, stop_services
+    from config import UNIVERSITIES
+
+    db.init_db()
+    stats = Stats()
+
+    def count_query(*_):
+        stats.queries[current_handler.get()] += 1
+    for engine in {db.engine, db.read_engine}:
+        event.listen(engine, "before_cursor_execute", count_query)
+
+    application = build_application("1:bench", args.users, StubBotAPI(stats, args.api_latency, args.flood_rate))
+    time_handlers(application, stats)
+    # Handler failures (e.g. simulated 429s on replies) are counted by timed()
+    application.add_error_handler(ignore_error)
+    async with application:
+        await start_services(application)
+        updates = UpdateFactory(application.bot)
+        registered = Gate(args.users)
+        paired = Gate(args.users)
+        base = 10_000_000
+        users = []
+        for i in range(args.users):
+            uid = base + i
+            # Pair neighbours of opposite gender for the chat phase
+            partner = uid + 1 if i % 2 == 0 else uid - 1
+            if partner >= base + args.users:
+                partner = None
+            users.append(run_user(
+                application, updates, stats, uid, "Male" if i % 2 == 0 else "Female", partner,
+                args, registered, paired, UNIVERSITIES
+            ))
+        started = time.perf_counter()
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - started
+        await stop_services(application)
+    report(stats, elapsed)
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    os.environ["FLOOD_CONTROL"] = "1" if args.flood_control else "0"
+    if args.db_url:
+        os.environ["DATABASE_URL"] = args.db_url
+    else:
+        path = os.path.join(tempfile.gettempdir(), "makabot-bench.db")
+        if os.path.exists(path):
+            os.remove(path)
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
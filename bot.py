@@ -0,0 +1,106 @@
+# bot.py
+# Builds the PTB Application shared by the web server (app.py) and the
+# benchmark harness (bench.py).
+
+from telegram import Update
+from telegram.request import HTTPXRequest
+from telegram.ext import (
+    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
+    ConversationHandler, ChatMemberHandler, TypeHandler, filters
+)
+from handlers import (
+    start, register_name, register_university, register_age, register_gender,
+    uni_selection_callback, register_interests, register_bio, register_photo,
+    profile, browse, browse_response, matches, matches_page, start_chat_callback, relay_chat_message, stop_chat,
+    track_channel_membership, registration_timeout
+)
+from confession import get_confess_conv_handler, moderate_confession
+from db import engine, read_engine, run_db
+from queries import active_chats
+from routing import chat_routes
+from swipes import swipe_writer
+from outbox import outbox
+from ordering import OrderedApplication
+from metrics import InstrumentedRequest, instrument_handlers, instrument_engine
+from throttle import flood_guard
+from publisher import confession_publisher
+from digests import like_digest
+from broadcast import broadcaster, broadcast_command, broadcast_cancel
+from config import CONVERSATION_TIMEOUT, FLOOD_CONTROL
+
+(NAME, UNIVERSITY, AGE, GENDER, INTERESTS, BIO, PHOTO, SELECT_UNIS) = range(8)
+
+def build_application(token, concurrent_updates, request=None, persistence=None):
+    # Updates arrive through a webhook route, so no Updater is needed
+    if request is None:
+        request = HTTPXRequest(connection_pool_size=256)
+    # Updates from one user run in order; different users run concurrently
+    builder = (
+        ApplicationBuilder()
+        .application_class(OrderedApplication, {"admit": flood_guard.allow if FLOOD_CONTROL else None})
+        .token(token)
+        .updater(None)
+        .concurrent_updates(concurrent_updates)
+        .request(InstrumentedRequest(request))
+    )
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    telegram_app = builder.build()
+    persistent = persistence is not None
+
+    reg_conv = ConversationHandler(
+        entry_points=[CommandHandler('start', start)],
+        states={
+            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_name)],
+            UNIVERSITY: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_university)],
+            AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_age)],
+            GENDER: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_gender)],
+            SELECT_UNIS: [CallbackQueryHandler(uni_selection_callback)],
+            INTERESTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_interests)],
+            BIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_bio)],
+            PHOTO: [MessageHandler(filters.PHOTO, register_photo)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, registration_timeout)],
+        },
+        fallbacks=[],
+        name="registration",
+        persistent=persistent,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+    )
+    telegram_app.add_handler(reg_conv)
+    telegram_app.add_handler(CommandHandler('profile', profile))
+    telegram_app.add_handler(CommandHandler('browse', browse))
+    telegram_app.add_handler(MessageHandler(filters.Regex(r"^(👍 Like|⏭️ Skip)$"), browse_response))
+    telegram_app.add_handler(CommandHandler('matches', matches))
+    telegram_app.add_handler(CallbackQueryHandler(matches_page, pattern="^matches_"))
+    telegram_app.add_handler(CallbackQueryHandler(start_chat_callback, pattern="^chatwith_"))
+    telegram_app.add_handler(CommandHandler('stopchat', stop_chat))
+    telegram_app.add_handler(CommandHandler('broadcast', broadcast_command))
+    telegram_app.add_handler(CommandHandler('broadcast_cancel', broadcast_cancel))
+    telegram_app.add_handler(CallbackQueryHandler(moderate_confession, pattern="^confession_"))
+    # Ahead of the catch-all relay, which would otherwise swallow the confession text
+    telegram_app.add_handler(get_confess_conv_handler(persistent, CONVERSATION_TIMEOUT))
+    telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, relay_chat_message))
+    telegram_app.add_handler(MessageHandler(filters.PHOTO, relay_chat_message))
+    telegram_app.add_handler(ChatMemberHandler(track_channel_membership, ChatMemberHandler.CHAT_MEMBER))
+
+    instrument_handlers(telegram_app)
+    instrument_engine(engine)
+    instrument_engine(read_engine)
+    return telegram_app
+
+async def start_services(telegram_app):
+    # Background state that lives next to an initialized Application
+    chat_routes.load(await run_db(active_chats))
+    outbox.start(telegram_app.bot)
+    flood_guard.start()
+    like_digest.start()
+    await broadcaster.start()
+    await confession_publisher.start()
+
+async def stop_services(telegram_app):
+    await broadcaster.stop()
+    await confession_publisher.stop()
+    await like_digest.stop()
+    await flood_guard.stop()
+    await swipe_writer.close()
+    await outbox.stop()
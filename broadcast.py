@@ -0,0 +1,146 @@
+# broadcast.py
+
+import asyncio
+import logging
+import time
+
+from telegram import Update
+from telegram.error import Forbidden, BadRequest
+from telegram.ext import ContextTypes
+
+from config import ADMIN_IDS, BROADCAST_CHUNK_SIZE, BROADCAST_PROGRESS_INTERVAL
+from db import run_db
+import queries
+from outbox import outbox, PRIORITY_BULK, PRIORITY_NOTICE
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+broadcast_messages = Counter("bot_broadcast_messages_total", "Broadcast messages by outcome", ("result",))
+
+def unreachable(exc):
+    # The user blocked the bot, deleted their account or never opened a chat
+    return isinstance(exc, Forbidden) or (isinstance(exc, BadRequest) and "chat not found" in str(exc).lower())
+
+class Broadcaster:
+    # Sends admin announcements to every registered user. Recipients are read
+    # in keyset chunks of users.id and queued on the outbox at PRIORITY_BULK,
+    # so its rate limits apply and interactive messages still go first. After
+    # each chunk the checkpoint, counters and newly unreachable users are
+    # saved in one transaction. Running broadcasts resume from the checkpoint
+    # at startup; a chunk in flight during shutdown may be sent again.
+    def __init__(self, chunk_size, progress_interval):
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self._tasks = {}
+
+    async def start(self):
+        for broadcast in await run_db(queries.running_broadcasts):
+            logger.info("Resuming broadcast %s after users.id %s", broadcast.id, broadcast.last_user_id)
+            self.begin(broadcast)
+
+    def begin(self, broadcast):
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[broadcast.id] = task
+        task.add_done_callback(lambda done: self._finished(broadcast.id, done))
+
+    def cancel(self, broadcast_id):
+        task = self._tasks.get(broadcast_id)
+        if task is not None:
+            task.cancel()
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _finished(self, broadcast_id, task):
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception():
+            logger.error("Broadcast %s stopped", broadcast_id, exc_info=task.exception())
+
+    async def _run(self, broadcast):
+        started = time.monotonic()
+        last_report = started
+        last_id = broadcast.last_user_id or 0
+        totals = {"sent": broadcast.sent or 0, "blocked": broadcast.blocked or 0, "failed": broadcast.failed or 0}
+        handled_here = 0
+        while True:
+            chunk = await run_db(queries.broadcast_chunk, last_id, self.chunk_size)
+            results = await asyncio.gather(
+                *(outbox.send_message(tg_id, broadcast.text, PRIORITY_BULK) for _, tg_id in chunk),
+                return_exceptions=True
+            )
+            sent, blocked_ids, failed = 0, [], 0
+            for (user_id, _), result in zip(chunk, results):
+                if not isinstance(result, Exception):
+                    sent += 1
+                elif unreachable(result):
+                    blocked_ids.append(user_id)
+                else:
+                    failed += 1
+            next_id = chunk[-1][0] if chunk else last_id
+            done = len(chunk) < self.chunk_size
+            saved = await run_db(
+                queries.save_broadcast_progress, broadcast.id, last_id, next_id,
+                sent, len(blocked_ids), failed, blocked_ids, done
+            )
+            if not saved:
+                logger.info("Broadcast %s was cancelled or is run by another worker", broadcast.id)
+                return
+            last_id = next_id
+            broadcast_messages.inc("sent", amount=sent)
+            broadcast_messages.inc("blocked", amount=len(blocked_ids))
+            broadcast_messages.inc("failed", amount=failed)
+            totals["sent"] += sent
+            totals["blocked"] += len(blocked_ids)
+            totals["failed"] += failed
+            handled_here += len(chunk)
+            now = time.monotonic()
+            if done or now - last_report >= self.progress_interval:
+                last_report = now
+                self._report(broadcast, totals, handled_here / max(now - started, 1e-6), done)
+            if done:
+                return
+
+    @staticmethod
+    def _report(broadcast, totals, rate, done):
+        handled = sum(totals.values())
+        title = f"✅ Broadcast #{broadcast.id} finished" if done else f"📣 Broadcast #{broadcast.id}"
+        outbox.send_message(
+            broadcast.admin_tg_id,
+            f"{title}: {handled}/{broadcast.total} users, {totals['sent']} sent, "
+            f"{totals['blocked']} unreachable, {totals['failed']} failed ({rate:.1f} msg/s)",
+            PRIORITY_NOTICE
+        )
+
+broadcaster = Broadcaster(BROADCAST_CHUNK_SIZE, BROADCAST_PROGRESS_INTERVAL)
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        return
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await update.message.reply_text("Usage: /broadcast <message to send to every registered user>")
+        return
+    broadcast = await run_db(queries.create_broadcast, parts[1], user.id)
+    broadcaster.begin(broadcast)
+    await update.message.reply_text(
+        f"📣 Broadcast #{broadcast.id} started for {broadcast.total} users.\n"
+        f"Send /broadcast_cancel {broadcast.id} to stop it."
+    )
+
+async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /broadcast_cancel <broadcast id>")
+        return
+    broadcast_id = int(context.args[0])
+    if not await run_db(queries.cancel_broadcast, broadcast_id):
+        await update.message.reply_text(f"Broadcast #{broadcast_id} is not running.")
+        return
+    broadcaster.cancel(broadcast_id)
+    await update.message.reply_text(f"🛑 Broadcast #{broadcast_id} cancelled.")
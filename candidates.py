@@ -0,0 +1,146 @@
+# candidates.py
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from config import CANDIDATE_BATCH_SIZE, CANDIDATE_LOW_WATER, CANDIDATE_BUFFER_USERS, CANDIDATE_POOL_SIZE
+from db import run_db, has_replica
+import queries
+from ranking import rank_candidates
+
+logger = logging.getLogger(__name__)
+
+NOT_REGISTERED = object()
+
+class CandidateQueue:
+    def __init__(self):
+        self.items = deque()      # loaded profiles, ready to show
+        self.ranked = deque()     # ranked candidate ids not loaded yet
+        self.cursor = 0           # keyset cursor: highest users.id ranked so far
+        self.seen = OrderedDict() # recently swiped ids, oldest first
+        self.registered = True
+        self.owner = None         # the browsing user's own row
+        self.shown = None         # candidate currently on screen
+        self.refill = None
+
+class CandidateBuffer:
+    # Per-user queue of prefetched browse candidates. A pool of matching ids
+    # is ranked by interest similarity, then profiles are loaded a batch at a
+    # time. Swipes are served from memory; the queue refills in the
+    # background below the low-water mark.
+    def __init__(self, batch_size, low_water, max_users, pool_size):
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self.max_users = max_users
+        self._queues = OrderedDict()
+
+    def _get(self, tg_id):
+        queue = self._queues.get(tg_id)
+        if queue is None:
+            queue = self._queues[tg_id] = CandidateQueue()
+            while len(self._queues) > self.max_users:
+                self._queues.popitem(last=False)
+        else:
+            self._queues.move_to_end(tg_id)
+        return queue
+
+    async def next(self, tg_id):
+        # Returns the next candidate, None when nothing matches, or
+        # NOT_REGISTERED when the user has no finished profile.
+        queue = self._get(tg_id)
+        while True:
+            if not queue.items:
+                await self._ensure_refill(tg_id, queue)
+                if not queue.registered:
+                    self._queues.pop(tg_id, None)
+                    return NOT_REGISTERED
+                if not queue.items:
+                    return None
+            candidate = queue.items.popleft()
+            if candidate.id not in queue.seen:
+                break
+        if len(queue.items) < self.low_water and queue.refill is None:
+            self._start_refill(tg_id, queue)
+        queue.shown = candidate
+        return candidate
+
+    def shown(self, tg_id, candidate_id):
+        # Returns (user, candidate) for the profile on screen, if still buffered
+        queue = self._queues.get(tg_id)
+        if queue is None or queue.owner is None or queue.shown is None or queue.shown.id != candidate_id:
+            return None
+        return queue.owner, queue.shown
+
+    def mark_swiped(self, tg_id, candidate_id):
+        queue = self._queues.get(tg_id)
+        if queue is None:
+            return
+        queue.seen[candidate_id] = None
+        queue.seen.move_to_end(candidate_id)
+        if len(queue.seen) > 4 * self.batch_size:
+            queue.seen.popitem(last=False)
+
+    def invalidate(self, tg_id):
+        # Drop the queue after the user's own preferences change
+        self._queues.pop(tg_id, None)
+
+    def _start_refill(self, tg_id, queue):
+        queue.refill = asyncio.ensure_future(self._fill(tg_id, queue))
+        queue.refill.add_done_callback(self._log_failure)
+
+    async def _ensure_refill(self, tg_id, queue):
+        if queue.refill is None:
+            self._start_refill(tg_id, queue)
+        await asyncio.shield(queue.refill)
+
+    async def _fill(self, tg_id, queue):
+        try:
+            if len(queue.ranked) < self.batch_size:
+                await self._rank_more(tg_id, queue)
+                if not queue.registered:
+                    return
+            ids = [queue.ranked.popleft() for _ in range(min(self.batch_size, len(queue.ranked)))]
+            if not ids:
+                return
+            batch = await run_db(queries.users_by_ids, ids, readonly=True)
+            queued = {candidate.id for candidate in queue.items}
+            queue.items.extend(
+                candidate for candidate in batch
+                if candidate.id not in queued and candidate.id not in queue.seen
+            )
+        finally:
+            queue.refill = None
+
+    async def _rank_more(self, tg_id, queue):
+        # Swipes made since the replica last caught up are still excluded
+        # through queue.seen; a brand new registration falls back to the primary
+        db_user, pool = await run_db(queries.candidate_pool, tg_id, queue.cursor, self.pool_size, readonly=True)
+        if db_user is None and has_replica:
+            db_user, pool = await run_db(queries.candidate_pool, tg_id, queue.cursor, self.pool_size)
+        if db_user and not pool and queue.cursor:
+            # Reached the end of the id range; start over from the beginning.
+            # The primary has the latest swipes, and queue.seen still covers
+            # the ones the swipe writer hasn't flushed yet.
+            queue.cursor = 0
+            db_user, pool = await run_db(queries.candidate_pool, tg_id, 0, self.pool_size)
+        queue.registered = db_user is not None
+        queue.owner = db_user
+        if not pool:
+            return
+        queue.cursor = pool[-1].id
+        pending = set(queue.ranked) | {candidate.id for candidate in queue.items} | queue.seen.keys()
+        queue.ranked.extend(
+            candidate_id for candidate_id in rank_candidates(db_user.interest_bits, pool)
+            if candidate_id not in pending
+        )
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception():
+            logger.error("Candidate refill failed", exc_info=task.exception())
+
+candidate_buffer = CandidateBuffer(
+    CANDIDATE_BATCH_SIZE, CANDIDATE_LOW_WATER, CANDIDATE_BUFFER_USERS, CANDIDATE_POOL_SIZE
+)
@@ -0,0 +1,57 @@
+# captions.py
+
+from collections import OrderedDict
+
+from config import CAPTION_CACHE_SIZE
+
+PROFILE = "profile"
+PREVIEW = "preview"
+
+def render_caption(user, kind):
+    if kind == PROFILE:
+        return (
+            f"👤 **Your Profile**\n"
+            f"Name: {user.name}\n"
+            f"University: {user.university}\n"
+            f"Age: {user.age}\n"
+            f"Gender: {user.gender}\n"
+            f"Interests: {user.interests}\n"
+            f"Bio: {user.bio}\n"
+            f"Interested in: {user.match_universities}\n"
+        )
+    return (
+        f"✨ **Profile Preview**\n"
+        f"Name: {user.name}\n"
+        f"University: {user.university}\n"
+        f"Age: {user.age}\n"
+        f"Gender: {user.gender}\n"
+        f"Interests: {user.interests}\n"
+        f"Bio: {user.bio}\n"
+    )
+
+class CaptionCache:
+    # LRU of (users.id, kind) -> (profile_updated_at, text). An entry is only
+    # served while the row's profile_updated_at matches, so a profile saved by
+    # another worker is never shown stale; invalidate() drops it eagerly.
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, user, kind):
+        key = (user.id, kind)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == user.profile_updated_at:
+            self._entries.move_to_end(key)
+            return entry[1]
+        text = render_caption(user, kind)
+        self._entries[key] = (user.profile_updated_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return text
+
+    def invalidate(self, user_id):
+        for kind in (PROFILE, PREVIEW):
+            self._entries.pop((user_id, kind), None)
+
+caption_cache = CaptionCache(CAPTION_CACHE_SIZE)
@@ -1,11 +1,33 @@
 # confession.py
 
-from telegram import Update, ReplyKeyboardRemove
+import hashlib
+import logging
+import re
+from datetime import datetime, timedelta
+
+from telegram import Update, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, MessageHandler, filters
-from config import CONFESSION_CHANNEL_ID
+from config import ADMIN_IDS, CONFESSION_MODERATION, CONFESSION_DEDUPE_HOURS
 from handlers import check_membership, require_channels
+from db import run_db
+import queries
+from outbox import outbox, PRIORITY_NOTICE
+from publisher import confession_publisher
+
+logger = logging.getLogger(__name__)
 
 CONFESS = 100
+APPROVE = "confession_ok_"
+REJECT = "confession_no_"
+
+if CONFESSION_MODERATION and not ADMIN_IDS:
+    logger.warning("CONFESSION_MODERATION is set but ADMIN_IDS is empty; confessions are not moderated")
+MODERATED = CONFESSION_MODERATION and bool(ADMIN_IDS)
+
+def confession_hash(text):
+    # Case, punctuation, emoji and spacing don't make a confession new
+    normalized = " ".join(re.findall(r"\w+", text.lower()))
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
 
 async def confess(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_membership(update, context):
@@ -23,27 +45,68 @@ async def receive_confession(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("❌ Confession too long (max 500 characters). Try again:")
         return CONFESS
 
-    await context.bot.send_message(
-        chat_id=CONFESSION_CHANNEL_ID,
-        text=f"📩 **New Confession:**\n\n{text}",
-        parse_mode="Markdown"
+    # Queued and acknowledged right away; publisher.py posts it at a steady rate
+    confession_id = await run_db(
+        queries.enqueue_confession, text, confession_hash(text), "pending" if MODERATED else "approved",
+        datetime.utcnow() - timedelta(hours=CONFESSION_DEDUPE_HOURS)
     )
+    if confession_id is None:
+        await update.message.reply_text(
+            "⚠️ This confession has already been submitted.", reply_markup=ReplyKeyboardRemove()
+        )
+        return ConversationHandler.END
+
+    if MODERATED:
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton("✅ Approve", callback_data=f"{APPROVE}{confession_id}"),
+            InlineKeyboardButton("❌ Reject", callback_data=f"{REJECT}{confession_id}"),
+        ]])
+        for admin_id in ADMIN_IDS:
+            outbox.send_message(
+                admin_id, f"📝 Confession #{confession_id} awaiting review:\n\n{text}", PRIORITY_NOTICE,
+                reply_markup=keyboard
+            )
+    else:
+        confession_publisher.notify()
 
     await update.message.reply_text(
-        "✅ Your confession has been posted anonymously!",
+        "✅ Your confession is queued and will be posted anonymously shortly!",
         reply_markup=ReplyKeyboardRemove()
     )
     return ConversationHandler.END
 
+async def moderate_confession(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("Only admins can moderate confessions.")
+        return
+    await query.answer()
+    approved = query.data.startswith(APPROVE)
+    confession_id = int(query.data.rsplit("_", 1)[1])
+    changed = await run_db(
+        queries.set_confession_status, confession_id, "pending", "approved" if approved else "rejected"
+    )
+    if not changed:
+        await query.edit_message_text(f"Confession #{confession_id} was already reviewed.")
+        return
+    if approved:
+        confession_publisher.notify()
+    await query.edit_message_text(
+        f"{'✅ Approved' if approved else '❌ Rejected'} confession #{confession_id}."
+    )
+
 async def cancel_confess(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Confession cancelled.", reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
-def get_confess_conv_handler():
+def get_confess_conv_handler(persistent=False, conversation_timeout=None):
     return ConversationHandler(
         entry_points=[CommandHandler('confess', confess)],
         states={
             CONFESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_confession)],
         },
         fallbacks=[CommandHandler('cancel', cancel_confess)],
+        name="confession",
+        persistent=persistent,
+        conversation_timeout=conversation_timeout,
     )
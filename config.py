@@ -1,5 +1,8 @@
 # config.py
 
+import os
+
+# Append only: list positions are stored as bitmasks (see universities.py)
 UNIVERSITIES = [
     "Addis Ababa University", "Jimma University", "Bahir Dar University", "Hawassa University",
     "Haramaya University", "University of Gondar", "Mekelle University", "Arba Minch University",
@@ -15,3 +18,85 @@ UNIVERSITIES = [
 
 REQUIRED_CHANNELS = ["@unimatch_ethio", "@unimatch_confession"]
 CONFESSION_CHANNEL_ID = "@unimatch_confession"
+
+# Channel membership cache (seconds / entries)
+MEMBERSHIP_CACHE_TTL = float(os.environ.get("MEMBERSHIP_CACHE_TTL", "600"))
+MEMBERSHIP_CACHE_NEGATIVE_TTL = float(os.environ.get("MEMBERSHIP_CACHE_NEGATIVE_TTL", "30"))
+MEMBERSHIP_CACHE_SIZE = int(os.environ.get("MEMBERSHIP_CACHE_SIZE", "50000"))
+
+# Per-user browse candidate prefetch
+CANDIDATE_BATCH_SIZE = int(os.environ.get("CANDIDATE_BATCH_SIZE", "20"))
+CANDIDATE_LOW_WATER = int(os.environ.get("CANDIDATE_LOW_WATER", "5"))
+CANDIDATE_BUFFER_USERS = int(os.environ.get("CANDIDATE_BUFFER_USERS", "10000"))
+
+# Write-behind buffering of likes/skips (seconds; 0 writes each swipe directly)
+SWIPE_FLUSH_INTERVAL = float(os.environ.get("SWIPE_FLUSH_INTERVAL", "0"))
+SWIPE_FLUSH_MAX_BATCH = int(os.environ.get("SWIPE_FLUSH_MAX_BATCH", "500"))
+
+# Outbound message scheduler (Telegram allows ~30 msg/s overall, ~1 msg/s per
+# private chat and 20 msg/min per group or channel)
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CHAT_RATE = float(os.environ.get("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = float(os.environ.get("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_GROUP_RATE_PER_MIN = float(os.environ.get("OUTBOX_GROUP_RATE_PER_MIN", "20"))
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", "8"))
+OUTBOX_MAX_RETRIES = int(os.environ.get("OUTBOX_MAX_RETRIES", "5"))
+# Candidates scored per ranking pass, and how much a recently updated
+# profile is boosted over interest similarity (0..1)
+CANDIDATE_POOL_SIZE = int(os.environ.get("CANDIDATE_POOL_SIZE", "1000"))
+RANK_RECENCY_WEIGHT = float(os.environ.get("RANK_RECENCY_WEIGHT", "0.2"))
+RANK_RECENCY_DAYS = float(os.environ.get("RANK_RECENCY_DAYS", "14"))
+
+# Persistence of conversations/user_data (seconds between flushes, seconds
+# before an unfinished conversation is abandoned, days user_data is kept)
+PERSISTENCE_INTERVAL = float(os.environ.get("PERSISTENCE_INTERVAL", "5"))
+CONVERSATION_TIMEOUT = float(os.environ.get("CONVERSATION_TIMEOUT", "86400"))
+USER_DATA_TTL_DAYS = float(os.environ.get("USER_DATA_TTL_DAYS", "30"))
+# Conversation states are loaded once at startup, so the bot must run as a
+# single worker. PERSISTENCE_SHARED reloads a user's user_data before each of
+# their updates when it was written by another worker, which costs a query
+# per update and still doesn't share conversations in progress.
+PERSISTENCE_SHARED = os.environ.get("PERSISTENCE_SHARED", "0") == "1"
+
+# Rendered profile captions and university selection keyboards kept in memory
+CAPTION_CACHE_SIZE = int(os.environ.get("CAPTION_CACHE_SIZE", "20000"))
+UNI_KEYBOARD_CACHE_SIZE = int(os.environ.get("UNI_KEYBOARD_CACHE_SIZE", "4096"))
+
+# Flood control: "<kind>=<rate per second>/<burst>" per update kind (browse,
+# matches, relay, command, callback). A user dropped FLOOD_BLOCK_AFTER times
+# in a row is muted for FLOOD_BLOCK_SECONDS; with FLOOD_SHARED the mutes are
+# shared between workers through the database every FLOOD_SYNC_INTERVAL.
+FLOOD_CONTROL = os.environ.get("FLOOD_CONTROL", "1") == "1"
+FLOOD_LIMITS = os.environ.get(
+    "FLOOD_LIMITS", "browse=1/10,matches=0.2/3,relay=2/10,command=0.5/5,callback=2/15"
+)
+FLOOD_BLOCK_AFTER = int(os.environ.get("FLOOD_BLOCK_AFTER", "20"))
+FLOOD_BLOCK_SECONDS = float(os.environ.get("FLOOD_BLOCK_SECONDS", "60"))
+FLOOD_SHARED = os.environ.get("FLOOD_SHARED", "0") == "1"
+FLOOD_SYNC_INTERVAL = float(os.environ.get("FLOOD_SYNC_INTERVAL", "5"))
+FLOOD_MAX_KEYS = int(os.environ.get("FLOOD_MAX_KEYS", "100000"))
+
+# Matches listed per /matches page
+MATCHES_PAGE_SIZE = int(os.environ.get("MATCHES_PAGE_SIZE", "10"))
+
+# Telegram user ids allowed to moderate confessions and run admin commands
+ADMIN_IDS = {int(tg_id) for tg_id in os.environ.get("ADMIN_IDS", "").split(",") if tg_id.strip()}
+# Confession queue: posts per minute to the channel, whether admins must
+# approve each one first, and how long identical text counts as a duplicate
+CONFESSION_RATE_PER_MIN = float(os.environ.get("CONFESSION_RATE_PER_MIN", "12"))
+CONFESSION_MODERATION = os.environ.get("CONFESSION_MODERATION", "0") == "1"
+CONFESSION_DEDUPE_HOURS = float(os.environ.get("CONFESSION_DEDUPE_HOURS", "24"))
+
+# Seconds over which "someone liked you" notices are merged into one digest
+# per recipient (0 sends one per like)
+LIKE_DIGEST_WINDOW = float(os.environ.get("LIKE_DIGEST_WINDOW", "600"))
+
+# Broadcasts: recipients loaded and queued per checkpoint, and seconds
+# between progress reports to the admin who started it
+BROADCAST_CHUNK_SIZE = int(os.environ.get("BROADCAST_CHUNK_SIZE", "500"))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get("BROADCAST_PROGRESS_INTERVAL", "60"))
+
+# Unmatched likes and skips older than this are moved to the archive tables
+# by `python maintenance.py archive`; the profile can then be shown again
+LIKES_RETENTION_DAYS = float(os.environ.get("LIKES_RETENTION_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "5000"))
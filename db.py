@@ -1,14 +1,64 @@
 # db.py
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import (
+    create_engine, inspect, text, bindparam, func, cast, Column, Integer, BigInteger, String, Boolean, ForeignKey,
+    DateTime, LargeBinary, Index, Float
+)
 from sqlalchemy.orm import declarative_base, sessionmaker
+import asyncio
+import contextvars
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from universities import university_bit, selection_mask
+from metrics import Histogram, Gauge
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
+# Optional streaming replica for run_db(..., readonly=True) work
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+# Threads that run blocking SQLAlchemy work off the event loop; keep this at or
+# below the engine's pool size + overflow so workers never wait on the pool.
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "8"))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", str(DB_WORKERS)))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "2"))
+# Seconds to wait for a free connection before raising
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+# Reconnect connections older than this many seconds (proxies and managed
+# databases drop idle connections); -1 disables
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+
+def _create_engine(url):
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    # SQLite uses a per-thread or singleton pool that takes no sizing options
+    if not url.startswith("sqlite"):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return create_engine(url, echo=False, **options)
+
 Base = declarative_base()
-engine = create_engine(DATABASE_URL, echo=False)
-SessionLocal = sessionmaker(bind=engine)
+engine = _create_engine(DATABASE_URL)
+read_engine = _create_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
+has_replica = read_engine is not engine
+# Objects are handed back to handlers after the session closes, so keep their
+# loaded attributes instead of expiring them on commit.
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, expire_on_commit=False)
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+pool_checkout_seconds = Histogram(
+    "bot_db_pool_checkout_seconds", "Time to get a pooled connection (wait, connect and pre-ping)", ("pool",)
+)
+executor_wait_seconds = Histogram(
+    "bot_db_executor_wait_seconds", "Time run_db() work waited for a DB thread", ("pool",)
+)
+Gauge(
+    "bot_db_pool_checked_out", "Connections currently checked out of the pool",
+    lambda: {("primary",): engine.pool.checkedout(), ("replica",): read_engine.pool.checkedout()}
+    if has_replica else {("primary",): engine.pool.checkedout()},
+    ("pool",)
+)
 
 class User(Base):
     __tablename__ = "users"
@@ -23,8 +73,18 @@ class User(Base):
     registered = Column(Boolean, default=False)
     photo_file_id = Column(String, nullable=True)
     bio = Column(String, default="")
-    match_universities = Column(String, default="")  # Comma-separated
+    match_universities = Column(String, default="")  # Comma-separated, for display
     chatting_with = Column(Integer, nullable=True)   # tg_id of chat partner
+    university_bit = Column(BigInteger, default=0)   # see universities.py
+    match_uni_mask = Column(BigInteger, default=0)   # OR of wanted university bits
+    interest_bits = Column(LargeBinary, nullable=True)  # hashed interests, see ranking.py
+    profile_updated_at = Column(DateTime, nullable=True)
+    blocked = Column(Boolean, default=False)          # bot blocked or account deleted
+
+    __table_args__ = (
+        # Candidate selection in /browse filters on these, then pages by id
+        Index("ix_users_browse_bits", "registered", "gender", "university_bit", "id"),
+    )
 
 class Like(Base):
     __tablename__ = "likes"
@@ -33,6 +93,252 @@ class Like(Base):
     to_user_id = Column(Integer, ForeignKey('users.id'))
     matched = Column(Boolean, default=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    matched_at = Column(DateTime)
+
+    __table_args__ = (
+        # Serves the browse exclusion anti-join and the reverse-like lookup
+        Index("ux_likes_from_to", "from_user_id", "to_user_id", unique=True),
+        # Keyset pages of /matches; partial, so unmatched likes don't bloat it
+        Index(
+            "ix_likes_matches", "from_user_id", "matched_at", "id",
+            postgresql_where=text("matched"), sqlite_where=text("matched")
+        ),
+        # Lets the archive job find expired unmatched likes without a scan
+        Index(
+            "ix_likes_unmatched_timestamp", "timestamp",
+            postgresql_where=text("NOT matched"), sqlite_where=text("NOT matched")
+        ),
+    )
+
+class Skip(Base):
+    __tablename__ = "skips"
+    id = Column(Integer, primary_key=True, index=True)
+    from_user_id = Column(Integer, ForeignKey('users.id'))
+    to_user_id = Column(Integer, ForeignKey('users.id'))
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ux_skips_from_to", "from_user_id", "to_user_id", unique=True),
+        Index("ix_skips_timestamp", "timestamp"),
+    )
+
+class LikeArchive(Base):
+    # Unmatched likes past LIKES_RETENTION_DAYS, moved out of the hot table by
+    # maintenance.py. Nothing on the request path reads these tables.
+    __tablename__ = "likes_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    from_user_id = Column(Integer)
+    to_user_id = Column(Integer)
+    timestamp = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class SkipArchive(Base):
+    __tablename__ = "skips_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    from_user_id = Column(Integer)
+    to_user_id = Column(Integer)
+    timestamp = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class BotState(Base):
+    # Serialized user_data and conversation states, see persistence.py
+    __tablename__ = "bot_state"
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    data = Column(LargeBinary)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class Confession(Base):
+    # Queue drained into the confession channel by publisher.py. Status goes
+    # pending (awaiting moderation) -> approved -> publishing -> posted, or
+    # ends as rejected/failed.
+    __tablename__ = "confessions"
+    id = Column(Integer, primary_key=True)
+    text = Column(String)
+    text_hash = Column(String(16))
+    status = Column(String(16))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime)   # when a publisher moved it to publishing
+    posted_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_confessions_status_id", "status", "id"),
+        Index("ix_confessions_hash_created", "text_hash", "created_at"),
+    )
+
+class Broadcast(Base):
+    # Announcement to every registered user, sent by broadcast.py in users.id
+    # order; last_user_id is the checkpoint a restarted worker resumes from.
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True)
+    text = Column(String)
+    admin_tg_id = Column(BigInteger)
+    status = Column(String(16), index=True)   # running, done, cancelled
+    last_user_id = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+class FloodBlock(Base):
+    # Users muted by the flood guard, shared between workers (see throttle.py)
+    __tablename__ = "flood_blocks"
+    tg_id = Column(BigInteger, primary_key=True)
+    until = Column(DateTime, index=True)
+
+def _dialect_insert():
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def insert_ignore(table):
+    # INSERT ... ON CONFLICT DO NOTHING for the dialects we deploy on
+    return _dialect_insert()(table).on_conflict_do_nothing()
+
+def upsert(table, key_columns):
+    # INSERT ... ON CONFLICT (key_columns) DO UPDATE SET <every other column>
+    stmt = _dialect_insert()(table)
+    return stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={column.name: stmt.excluded[column.name] for column in table.columns if column.name not in key_columns}
+    )
+
+def lock_pairs(session, pairs):
+    # Transaction-scoped advisory lock per unordered (a, b) id pair, taken in
+    # a fixed order so two callers can't deadlock. SQLite already runs one
+    # writer at a time.
+    if engine.dialect.name != "postgresql":
+        return
+    for a, b in sorted({(min(pair), max(pair)) for pair in pairs}):
+        session.execute(text("SELECT pg_advisory_xact_lock(:a, :b)"), {"a": a, "b": b})
+
+def epoch_seconds(column):
+    # Naive UTC DateTime -> float seconds since the epoch, computed by the DB
+    if engine.dialect.name == "postgresql":
+        return cast(func.extract("epoch", column), Float)
+    return (func.julianday(column) - 2440587.5) * 86400.0
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _ensure_columns()
+    _ensure_indexes()
+
+def _ensure_columns():
+    # create_all() doesn't alter existing tables; add columns introduced later
+    # and backfill the ones derived from older data.
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        added = set()
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    added.add((table.name, column.name))
+        if ("users", "match_uni_mask") in added:
+            _backfill_university_bits(conn)
+        if ("users", "interest_bits") in added:
+            _backfill_interest_bits(conn)
+        if ("likes", "matched_at") in added:
+            # Best available match time for pairs matched before the column existed
+            conn.execute(text("UPDATE likes SET matched_at = timestamp WHERE matched = TRUE"))
+
+def _ensure_indexes():
+    # create_all() skips tables that already exist, so add indexes introduced
+    # after those tables were first created.
+    with engine.begin() as conn:
+        existing = {ix["name"] for ix in inspect(conn).get_indexes("likes")}
+        if "ux_likes_from_to" not in existing:
+            _dedupe_likes(conn)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def _backfill_university_bits(conn):
+    users = User.__table__
+    rows = conn.execute(users.select().with_only_columns(
+        users.c.id, users.c.university, users.c.match_universities
+    )).all()
+    if not rows:
+        return
+    conn.execute(
+        users.update().where(users.c.id == bindparam("user_id")).values(
+            university_bit=bindparam("bit"), match_uni_mask=bindparam("mask")
+        ),
+        [
+            {
+                "user_id": row.id,
+                "bit": university_bit(row.university),
+                "mask": selection_mask((row.match_universities or "").split(",")),
+            }
+            for row in rows
+        ]
+    )
+    # Superseded by ix_users_browse_bits
+    conn.execute(text("DROP INDEX IF EXISTS ix_users_browse"))
+
+def _backfill_interest_bits(conn):
+    from ranking import interest_bits
+    users = User.__table__
+    rows = conn.execute(users.select().with_only_columns(users.c.id, users.c.interests)).all()
+    if not rows:
+        return
+    conn.execute(
+        users.update().where(users.c.id == bindparam("user_id")).values(interest_bits=bindparam("bits")),
+        [{"user_id": row.id, "bits": interest_bits(row.interests)} for row in rows]
+    )
+
+def _dedupe_likes(conn):
+    # Double taps used to store the same like twice; keep the oldest row
+    conn.execute(text(
+        "UPDATE likes SET matched = TRUE, matched_at = COALESCE(matched_at, timestamp) WHERE EXISTS ("
+        " SELECT 1 FROM likes d WHERE d.from_user_id = likes.from_user_id"
+        " AND d.to_user_id = likes.to_user_id AND d.matched = TRUE)"
+    ))
+    conn.execute(text(
+        "DELETE FROM likes WHERE EXISTS ("
+        " SELECT 1 FROM likes d WHERE d.from_user_id = likes.from_user_id"
+        " AND d.to_user_id = likes.to_user_id AND d.id < likes.id)"
+    ))
+
+@contextmanager
+def session_scope(readonly=False):
+    session = ReadSessionLocal() if readonly else SessionLocal()
+    try:
+        # Check out the connection up front so the pool wait is measured alone
+        started = time.perf_counter()
+        session.connection()
+        pool_checkout_seconds.observe(time.perf_counter() - started, _pool_name(readonly))
+        yield session
+        # Read-only sessions end in close(), which rolls back without expiring
+        # the loaded objects that are handed back to the caller
+        if not readonly:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def _pool_name(readonly):
+    return "replica" if readonly and has_replica else "primary"
+
+async def run_db(fn, *args, readonly=False):
+    # Runs fn(session, *args) in the DB thread pool inside its own transaction.
+    # readonly=True sends it to the replica when one is configured; use it
+    # only where a few seconds of replication lag are acceptable.
+    # The caller's contextvars are carried over so query events can be
+    # attributed to the handler that issued them.
+    submitted = time.perf_counter()
+
+    def call():
+        executor_wait_seconds.observe(time.perf_counter() - submitted, _pool_name(readonly))
+        with session_scope(readonly) as session:
+            return fn(session, *args)
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_executor, context.run, call)
@@ -0,0 +1,80 @@
+# digests.py
+
+import asyncio
+import logging
+from datetime import datetime
+
+from config import LIKE_DIGEST_WINDOW
+from db import run_db
+import queries
+from outbox import outbox, PRIORITY_LIKE
+
+logger = logging.getLogger(__name__)
+
+class LikeDigest:
+    # Collects "someone liked you" events per recipient and sends one digest
+    # per window with the number of unanswered likes received since the last
+    # one. The count comes from the likes table, so likes stored by other
+    # workers are included; the local tally covers likes stored right at the
+    # window boundary. A zero window notifies on every like.
+    def __init__(self, window):
+        self.window = window
+        self._pending = {}   # recipient users.id -> [tg_id, likes seen here]
+        self._since = None
+        self._task = None
+
+    def start(self):
+        if self.window > 0 and self._task is None:
+            self._since = datetime.utcnow()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await self._flush()
+        except Exception:
+            logger.exception("Failed to send like digests")
+
+    def add(self, user_id, tg_id):
+        if self._task is None:
+            self._send(tg_id, 1)
+            return
+        entry = self._pending.setdefault(user_id, [tg_id, 0])
+        entry[1] += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("Failed to send like digests")
+
+    async def _flush(self):
+        pending, self._pending = self._pending, {}
+        since, self._since = self._since, datetime.utcnow()
+        if not pending:
+            return
+        counts = await run_db(queries.unmatched_like_counts, list(pending), since)
+        for user_id, (tg_id, seen) in pending.items():
+            count = max(counts.get(user_id, 0), seen)
+            self._send(tg_id, count)
+
+    @staticmethod
+    def _send(tg_id, count):
+        if count == 1:
+            title = "💌 **Someone just liked your profile on Unimatch Ethio!**"
+        else:
+            title = f"💌 **{count} people liked your profile on Unimatch Ethio!**"
+        outbox.send_message(
+            tg_id,
+            f"{title}\nBrowse profiles to see if you like them back and get a match!",
+            PRIORITY_LIKE,
+            parse_mode="Markdown"
+        )
+
+like_digest = LikeDigest(LIKE_DIGEST_WINDOW)
@@ -1,27 +1,43 @@
 # handlers.py
 
-from telegram import (
-    Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
-)
+from telegram import Update, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
-from db import User, Like, SessionLocal
-from config import UNIVERSITIES, REQUIRED_CHANNELS
+from db import run_db, has_replica
+import queries
+from candidates import candidate_buffer, NOT_REGISTERED
+from swipes import swipe_writer
+from routing import chat_routes
+from outbox import outbox, PRIORITY_RELAY, PRIORITY_MATCH, PRIORITY_NOTICE
+from digests import like_digest
+from universities import UNIVERSITY_BITS
+from membership import membership_cache, is_required_channel, ACTIVE_STATUSES
+from keyboards import (
+    UNIVERSITY_KEYBOARD, AGE_KEYBOARD, GENDER_KEYBOARD, SWIPE_KEYBOARD, MATCHES_NEWER, build_uni_keyboard,
+    matches_keyboard, parse_matches_cursor
+)
+from config import MATCHES_PAGE_SIZE
+from captions import caption_cache, PROFILE, PREVIEW
 
 (NAME, UNIVERSITY, AGE, GENDER, INTERESTS, BIO, PHOTO, SELECT_UNIS) = range(8)
-
-def get_session():
-    return SessionLocal()
+MATCHES_TEXT = "💑 **Your matches:**\nTap a name to start chatting anonymously."
+REGISTRATION_KEYS = (
+    'name', 'university', 'age', 'gender', 'looking_for', 'selected_unis', 'looking_for_unis',
+    'interests', 'bio', 'photo_file_id'
+)
 
 async def check_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    for channel in REQUIRED_CHANNELS:
-        try:
-            member = await context.bot.get_chat_member(chat_id=channel, user_id=user_id)
-            if member.status not in ['member', 'administrator', 'creator']:
-                return False
-        except Exception:
-            return False
-    return True
+    return await membership_cache.is_member(context.bot, update.effective_user.id)
+
+async def track_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    change = update.chat_member
+    if not is_required_channel(change.chat):
+        return
+    user_id = change.new_chat_member.user.id
+    if change.new_chat_member.status in ACTIVE_STATUSES:
+        # Joined one channel; re-check both on the next message
+        membership_cache.invalidate(user_id)
+    else:
+        membership_cache.set(user_id, False)
 
 async def require_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
@@ -37,9 +53,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await require_channels(update, context)
         return
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
+    db_user = await run_db(queries.get_user, user.id)
     if db_user and db_user.registered:
+        if db_user.blocked:
+            # Writing to the bot again means broadcasts reach them again
+            await run_db(queries.unblock_user, user.id)
         await update.message.reply_text(
             "👋 Welcome back to **Unimatch Ethio**! Ready to find your campus match? 💘\n\n"
             "Use /browse to discover profiles, /profile to view/edit yours, /matches to chat with your matches.",
@@ -58,11 +76,9 @@ async def register_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await require_channels(update, context)
         return
     context.user_data['name'] = update.message.text
-    keyboard = [UNIVERSITIES[i:i+2] for i in range(0, len(UNIVERSITIES), 2)]
-    keyboard.append(["Other"])
     await update.message.reply_text(
         "🏫 Which university do you attend? Please select from the list:",
-        reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+        reply_markup=UNIVERSITY_KEYBOARD
     )
     return UNIVERSITY
 
@@ -70,12 +86,11 @@ async def register_university(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not await check_membership(update, context):
         await require_channels(update, context)
         return
-    if update.message.text not in UNIVERSITIES and update.message.text != "Other":
+    if update.message.text not in UNIVERSITY_BITS:
         await update.message.reply_text("❗️Please select a university from the list.")
         return UNIVERSITY
     context.user_data['university'] = update.message.text
-    age_buttons = [[str(i)] for i in range(18, 31)]
-    await update.message.reply_text("🎂 How old are you?", reply_markup=ReplyKeyboardMarkup(age_buttons, one_time_keyboard=True, resize_keyboard=True))
+    await update.message.reply_text("🎂 How old are you?", reply_markup=AGE_KEYBOARD)
     return AGE
 
 async def register_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -93,18 +108,10 @@ async def register_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return AGE
     await update.message.reply_text(
         "🚻 What's your gender?",
-        reply_markup=ReplyKeyboardMarkup([["Male"], ["Female"]], one_time_keyboard=True, resize_keyboard=True)
+        reply_markup=GENDER_KEYBOARD
     )
     return GENDER
 
-def build_uni_keyboard(selected_unis, all_unis):
-    keyboard = []
-    for uni in all_unis:
-        checked = "✔️ " if uni in selected_unis else ""
-        keyboard.append([InlineKeyboardButton(f"{checked}{uni}", callback_data=uni)])
-    keyboard.append([InlineKeyboardButton("✅ Done", callback_data="__done__")])
-    return InlineKeyboardMarkup(keyboard)
-
 async def register_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_membership(update, context):
         await require_channels(update, context)
@@ -119,7 +126,7 @@ async def register_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "🏫 **Select all universities you are interested in for matches.**\n"
         "Tap to select/deselect. Press ✅ Done when finished.",
-        reply_markup=build_uni_keyboard([], UNIVERSITIES + ["All Universities"]),
+        reply_markup=build_uni_keyboard([]),
         parse_mode="Markdown"
     )
     return SELECT_UNIS
@@ -136,7 +143,7 @@ async def uni_selection_callback(update: Update, context: ContextTypes.DEFAULT_T
             await query.message.reply_text(
                 "🏫 **Select all universities you are interested in for matches.**\n"
                 "Tap to select/deselect. Press ✅ Done when finished.",
-                reply_markup=build_uni_keyboard(selected_unis, UNIVERSITIES + ["All Universities"]),
+                reply_markup=build_uni_keyboard(selected_unis),
                 parse_mode="Markdown"
             )
             return SELECT_UNIS
@@ -158,7 +165,7 @@ async def uni_selection_callback(update: Update, context: ContextTypes.DEFAULT_T
             selected_unis.append(uni)
     context.user_data['selected_unis'] = selected_unis
 
-    await query.edit_message_reply_markup(reply_markup=build_uni_keyboard(selected_unis, UNIVERSITIES + ["All Universities"]))
+    await query.edit_message_reply_markup(reply_markup=build_uni_keyboard(selected_unis))
     return SELECT_UNIS
 
 async def register_interests(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -177,22 +184,9 @@ async def register_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return PHOTO
     context.user_data['photo_file_id'] = update.message.photo[-1].file_id
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
-    if not db_user:
-        db_user = User(tg_id=user.id)
-        session.add(db_user)
-    db_user.name = context.user_data['name']
-    db_user.university = context.user_data['university']
-    db_user.age = context.user_data['age']
-    db_user.gender = context.user_data['gender']
-    db_user.interests = context.user_data['interests']
-    db_user.bio = context.user_data['bio']
-    db_user.looking_for = context.user_data['looking_for']
-    db_user.photo_file_id = context.user_data['photo_file_id']
-    db_user.registered = True
-    db_user.match_universities = ",".join(context.user_data['looking_for_unis'])
-    session.commit()
+    db_user = await run_db(queries.save_profile, user.id, dict(context.user_data))
+    candidate_buffer.invalidate(user.id)
+    caption_cache.invalidate(db_user.id)
     await update.message.reply_text(
         "✅ **Profile created!** Use /browse to find matches. Good luck! 🍀",
         parse_mode="Markdown",
@@ -200,70 +194,47 @@ async def register_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return -1  # ConversationHandler.END
 
+async def registration_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Abandoned registration: drop the half-filled profile from user_data
+    for key in REGISTRATION_KEYS:
+        context.user_data.pop(key, None)
+
 async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
+    db_user = await run_db(queries.get_user, user.id, readonly=True)
+    if (not db_user or not db_user.registered) and has_replica:
+        # The replica may not have caught up with a registration just saved
+        db_user = await run_db(queries.get_user, user.id)
     if not db_user or not db_user.registered:
         await update.message.reply_text("❗️You need to register first. Use /start.")
         return
-    text = (
-        f"👤 **Your Profile**\n"
-        f"Name: {db_user.name}\n"
-        f"University: {db_user.university}\n"
-        f"Age: {db_user.age}\n"
-        f"Gender: {db_user.gender}\n"
-        f"Interests: {db_user.interests}\n"
-        f"Bio: {db_user.bio}\n"
-        f"Interested in: {db_user.match_universities}\n"
-    )
     await update.message.reply_photo(
         photo=db_user.photo_file_id,
-        caption=text,
+        caption=caption_cache.get(db_user, PROFILE),
         parse_mode="Markdown"
     )
 
 async def browse(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
-    if not db_user or not db_user.registered:
+    await show_next_candidate(update, context)
+
+async def show_next_candidate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Served from the prefetched candidate queue; no DB query when it is warm
+    candidate = await candidate_buffer.next(update.effective_user.id)
+    if candidate is NOT_REGISTERED:
         await update.message.reply_text("❗️You need to register first. Use /start.")
         return
 
-    # Get universities the user is interested in
-    user_unis = db_user.match_universities.split(",")
-    # Exclude already liked/skipped users
-    liked_ids = [like.to_user_id for like in session.query(Like).filter_by(from_user_id=db_user.id)]
-    match_query = session.query(User).filter(
-        User.id != db_user.id,
-        User.gender == db_user.looking_for,
-        User.registered == True,
-        ~User.id.in_(liked_ids)
-    )
-    if "All Universities" not in user_unis:
-        match_query = match_query.filter(User.university.in_(user_unis))
-    candidate = match_query.first()
     if not candidate:
+        context.user_data.pop('browse_user_id', None)
         await update.message.reply_text("😕 No more profiles match your criteria right now. Please check back later!")
         return
 
     context.user_data['browse_user_id'] = candidate.id
-    text = (
-        f"✨ **Profile Preview**\n"
-        f"Name: {candidate.name}\n"
-        f"University: {candidate.university}\n"
-        f"Age: {candidate.age}\n"
-        f"Gender: {candidate.gender}\n"
-        f"Interests: {candidate.interests}\n"
-        f"Bio: {candidate.bio}\n"
-    )
-    keyboard = ReplyKeyboardMarkup([["👍 Like", "⏭️ Skip"]], one_time_keyboard=True, resize_keyboard=True)
     await update.message.reply_photo(
         photo=candidate.photo_file_id,
-        caption=text,
+        caption=caption_cache.get(candidate, PREVIEW),
         parse_mode="Markdown",
-        reply_markup=keyboard
+        reply_markup=SWIPE_KEYBOARD
     )
 
 async def browse_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -271,84 +242,81 @@ async def browse_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await require_channels(update, context)
         return
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
-    target_id = context.user_data.get('browse_user_id')
+    # Pop so a quick double tap can't swipe the same profile twice
+    target_id = context.user_data.pop('browse_user_id', None)
     if not target_id:
         await update.message.reply_text("❗️No profile selected. Use /browse.")
         return
 
-    if update.message.text.startswith("👍"):
-        like = Like(from_user_id=db_user.id, to_user_id=target_id)
-        session.add(like)
-        liked_user = session.query(User).filter_by(id=target_id).first()
-
-        # Notify the liked user immediately, even if not a match
-        try:
-            await context.bot.send_message(
-                chat_id=liked_user.tg_id,
-                text=(
-                    f"💌 **Someone just liked your profile on Unimatch Ethio!**\n"
-                    "Browse profiles to see if you like them back and get a match!"
-                ),
-                parse_mode="Markdown"
-            )
-        except Exception:
-            pass
-
-        # Check for mutual like (match)
-        mutual = session.query(Like).filter_by(from_user_id=target_id, to_user_id=db_user.id).first()
-        if mutual:
-            like.matched = True
-            mutual.matched = True
-            session.commit()
-            await update.message.reply_text(
-                f"🎉 **It's a match!** You and {liked_user.name} liked each other! Start a conversation now. 🥳",
-                parse_mode="Markdown"
-            )
-            try:
-                await context.bot.send_message(
-                    chat_id=liked_user.tg_id,
-                    text=(
-                        f"🎉 **It's a match!** You and {db_user.name} liked each other! "
-                        "Start a conversation now. 🥳"
-                    ),
-                    parse_mode="Markdown"
-                )
-            except Exception:
-                pass
-        else:
-            session.commit()
-            await update.message.reply_text("👍 Liked! Use /browse to see more profiles.")
-    else:
-        await update.message.reply_text("⏭️ Skipped. Use /browse to see more profiles.")
+    candidate_buffer.mark_swiped(user.id, target_id)
+    parties = candidate_buffer.shown(user.id, target_id)
+    if parties is None:
+        parties = await run_db(queries.swipe_parties, user.id, target_id)
+    db_user, liked_user = parties
+    if not db_user or not liked_user:
+        await update.message.reply_text("❗️No profile selected. Use /browse.")
+        return
+
+    liked = update.message.text.startswith("👍")
+    is_match = await swipe_writer.record(db_user.id, target_id, liked)
+    if liked and is_match:
+        await update.message.reply_text(
+            f"🎉 **It's a match!** You and {liked_user.name} liked each other! Start a conversation now. 🥳",
+            parse_mode="Markdown"
+        )
+        outbox.send_message(
+            liked_user.tg_id,
+            (
+                f"🎉 **It's a match!** You and {db_user.name} liked each other! "
+                "Start a conversation now. 🥳"
+            ),
+            PRIORITY_MATCH,
+            parse_mode="Markdown"
+        )
+    elif liked:
+        # Merged into a periodic digest instead of one message per like
+        like_digest.add(liked_user.id, liked_user.tg_id)
+    # Serve the next profile right away instead of waiting for another /browse
+    await show_next_candidate(update, context)
 
 async def matches(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
-    if not db_user:
+    registered, rows, has_older = await run_db(
+        queries.list_matches, user.id, None, False, MATCHES_PAGE_SIZE, readonly=True
+    )
+    if not registered and has_replica:
+        registered, rows, has_older = await run_db(queries.list_matches, user.id, None, False, MATCHES_PAGE_SIZE)
+    if not registered:
         await update.message.reply_text("❗️You need to register first. Use /start.")
         return
 
-    likes = session.query(Like).filter_by(from_user_id=db_user.id, matched=True).all()
-    match_ids = [like.to_user_id for like in likes]
-    matches = session.query(User).filter(User.id.in_(match_ids)).all()
-
-    if not matches:
+    if not rows:
         await update.message.reply_text("💔 You have no matches yet. Keep browsing and liking!")
         return
 
-    buttons = [
-        [InlineKeyboardButton(f"{m.name} ({m.university})", callback_data=f"chatwith_{m.tg_id}")]
-        for m in matches
-    ]
     await update.message.reply_text(
-        "💑 **Your matches:**\nTap a name to start chatting anonymously.",
-        reply_markup=InlineKeyboardMarkup(buttons),
+        MATCHES_TEXT,
+        reply_markup=matches_keyboard(rows, False, has_older),
         parse_mode="Markdown"
     )
 
+async def matches_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    newer = query.data.startswith(MATCHES_NEWER)
+    cursor = parse_matches_cursor(query.data[len(MATCHES_NEWER):])
+    _, rows, has_more = await run_db(
+        queries.list_matches, update.effective_user.id, cursor, newer, MATCHES_PAGE_SIZE, readonly=True
+    )
+    if not rows:
+        return
+    # Arriving from one side means the other side has at least one page
+    if newer:
+        keyboard = matches_keyboard(rows, has_more, True)
+    else:
+        keyboard = matches_keyboard(rows, True, has_more)
+    await query.edit_message_text(MATCHES_TEXT, reply_markup=keyboard, parse_mode="Markdown")
+
 async def start_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -357,15 +325,11 @@ async def start_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     target_tg_id = int(data.split("_")[1])
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
-    target_user = session.query(User).filter_by(tg_id=target_tg_id).first()
+    target_user = await run_db(queries.open_chat, user.id, target_tg_id)
     if not target_user:
         await query.edit_message_text("❗️User not found.")
         return
-    db_user.chatting_with = target_user.tg_id
-    target_user.chatting_with = db_user.tg_id
-    session.commit()
+    chat_routes.connect(user.id, target_user.tg_id)
     await query.edit_message_text(
         f"🗨️ You are now chatting anonymously with **{target_user.name}**.\n"
         "Send a message and I'll deliver it!\nSend /stopchat to end this chat."
@@ -373,43 +337,41 @@ async def start_chat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def relay_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
-    if not db_user or not db_user.chatting_with:
+    # Routed from memory; most messages here come from users not in a chat
+    partner_tg_id = chat_routes.partner(user.id)
+    if partner_tg_id is None:
         return
-    target_user = session.query(User).filter_by(tg_id=db_user.chatting_with).first()
-    if not target_user or target_user.chatting_with != user.id:
+    if chat_routes.partner(partner_tg_id) != user.id:
+        await run_db(queries.leave_chat, user.id)
+        chat_routes.leave(user.id)
         await update.message.reply_text("❗️Chat session expired. Use /matches to start again.")
-        db_user.chatting_with = None
-        session.commit()
         return
     # Relay the message
     if update.message.text:
-        await context.bot.send_message(
-            chat_id=target_user.tg_id,
-            text=f"💬 Anonymous message from your match:\n\n{update.message.text}"
+        outbox.send_message(
+            partner_tg_id,
+            f"💬 Anonymous message from your match:\n\n{update.message.text}",
+            PRIORITY_RELAY
         )
     elif update.message.photo:
-        await context.bot.send_photo(
-            chat_id=target_user.tg_id,
-            photo=update.message.photo[-1].file_id,
+        outbox.send_photo(
+            partner_tg_id,
+            update.message.photo[-1].file_id,
+            PRIORITY_RELAY,
             caption="📷 Anonymous photo from your match"
         )
 
 async def stop_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    session = get_session()
-    db_user = session.query(User).filter_by(tg_id=user.id).first()
-    if db_user and db_user.chatting_with:
-        target_user = session.query(User).filter_by(tg_id=db_user.chatting_with).first()
-        if target_user:
-            target_user.chatting_with = None
-            await context.bot.send_message(
-                chat_id=target_user.tg_id,
-                text="🔕 Your match has left the chat. Use /matches to start a new chat."
+    was_chatting, partner_tg_id = await run_db(queries.close_chat, user.id)
+    chat_routes.close(user.id)
+    if was_chatting:
+        if partner_tg_id:
+            outbox.send_message(
+                partner_tg_id,
+                "🔕 Your match has left the chat. Use /matches to start a new chat.",
+                PRIORITY_NOTICE
             )
-        db_user.chatting_with = None
-        session.commit()
         await update.message.reply_text("🔕 You have left the chat. Use /matches to chat again.")
     else:
         await update.message.reply_text("❗️You are not in a chat session.")
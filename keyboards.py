@@ -0,0 +1,65 @@
+# keyboards.py
+# Reply and inline keyboards used during registration and browsing. The
+# static ones are built once at import; university selection keyboards are
+# cached by the selection bitmask (see universities.selection_mask).
+
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from telegram import ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import UNIVERSITIES, UNI_KEYBOARD_CACHE_SIZE
+from universities import ALL_UNIVERSITIES, OTHER_UNIVERSITY, ALL_MASK, UNIVERSITY_BITS, selection_mask
+
+UNI_CHOICES = tuple(UNIVERSITIES) + (ALL_UNIVERSITIES,)
+
+UNIVERSITY_KEYBOARD = ReplyKeyboardMarkup(
+    [UNIVERSITIES[i:i+2] for i in range(0, len(UNIVERSITIES), 2)] + [[OTHER_UNIVERSITY]],
+    one_time_keyboard=True, resize_keyboard=True
+)
+AGE_KEYBOARD = ReplyKeyboardMarkup([[str(i)] for i in range(18, 31)], one_time_keyboard=True, resize_keyboard=True)
+GENDER_KEYBOARD = ReplyKeyboardMarkup([["Male"], ["Female"]], one_time_keyboard=True, resize_keyboard=True)
+SWIPE_KEYBOARD = ReplyKeyboardMarkup([["👍 Like", "⏭️ Skip"]], one_time_keyboard=True, resize_keyboard=True)
+
+EPOCH = datetime(1970, 1, 1)
+MATCHES_OLDER = "matches_o_"
+MATCHES_NEWER = "matches_n_"
+
+def matches_cursor(matched_at, like_id):
+    # Keyset position packed into callback data (well under the 64-byte limit)
+    return f"{(matched_at - EPOCH) // timedelta(microseconds=1)}_{like_id}"
+
+def parse_matches_cursor(data):
+    micros, like_id = data.split("_")
+    return EPOCH + timedelta(microseconds=int(micros)), int(like_id)
+
+def matches_keyboard(rows, has_newer, has_older):
+    buttons = [
+        [InlineKeyboardButton(f"{name} ({university})", callback_data=f"chatwith_{tg_id}")]
+        for _, _, tg_id, name, university in rows
+    ]
+    navigation = []
+    if has_newer:
+        first = rows[0]
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=MATCHES_NEWER + matches_cursor(first[1], first[0])))
+    if has_older:
+        last = rows[-1]
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=MATCHES_OLDER + matches_cursor(last[1], last[0])))
+    if navigation:
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(buttons)
+
+def build_uni_keyboard(selected_unis):
+    return _uni_keyboard(selection_mask(selected_unis))
+
+@lru_cache(maxsize=UNI_KEYBOARD_CACHE_SIZE)
+def _uni_keyboard(mask):
+    keyboard = []
+    for uni in UNI_CHOICES:
+        if uni == ALL_UNIVERSITIES:
+            checked = mask == ALL_MASK
+        else:
+            checked = mask != ALL_MASK and bool(mask & UNIVERSITY_BITS[uni])
+        keyboard.append([InlineKeyboardButton(f"{'✔️ ' if checked else ''}{uni}", callback_data=uni)])
+    keyboard.append([InlineKeyboardButton("✅ Done", callback_data="__done__")])
+    return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,104 @@
+# maintenance.py
+# Housekeeping for the database, meant for a cron job or a one-off shell:
+#
+#   python maintenance.py archive [--days 90] [--batch 5000]
+#   python maintenance.py sizes
+#
+# `archive` moves unmatched likes and skips older than the retention period
+# into likes_archive/skips_archive in small transactions, so the hot tables
+# (and the indexes browse and matching use) only hold recent swipes and
+# matched pairs. `sizes` reports table and index sizes.
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from config import LIKES_RETENTION_DAYS, ARCHIVE_BATCH_SIZE
+from db import engine, session_scope, Base
+import queries
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_parser = commands.add_parser("archive", help="move expired unmatched likes and skips to archive tables")
+    archive_parser.add_argument("--days", type=float, default=LIKES_RETENTION_DAYS, help="retention in days")
+    archive_parser.add_argument("--batch", type=int, default=ARCHIVE_BATCH_SIZE, help="rows per transaction")
+    commands.add_parser("sizes", help="report table and index sizes")
+    return parser.parse_args()
+
+def archive(days, batch):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    for liked, name in ((True, "likes"), (False, "skips")):
+        started = time.perf_counter()
+        moved = 0
+        while True:
+            with session_scope() as session:
+                count = queries.archive_swipes(session, liked, cutoff, batch)
+            moved += count
+            if count < batch:
+                break
+        print(f"{name}: archived {moved} rows older than {cutoff:%Y-%m-%d} in {time.perf_counter() - started:.1f}s")
+
+def human(size):
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def sizes():
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            _postgres_sizes(conn)
+        else:
+            _sqlite_sizes(conn)
+
+def _postgres_sizes(conn):
+    tables = conn.execute(text(
+        "SELECT c.relname, pg_total_relation_size(c.oid), pg_relation_size(c.oid), pg_indexes_size(c.oid),"
+        " c.reltuples::bigint"
+        " FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace"
+        " WHERE n.nspname = current_schema() AND c.relkind = 'r'"
+        " ORDER BY 2 DESC"
+    )).all()
+    print(f"{'table':<24}{'total':>12}{'heap':>12}{'indexes':>12}{'rows (est)':>14}")
+    for name, total, heap, indexes, rows in tables:
+        print(f"{name:<24}{human(total):>12}{human(heap):>12}{human(indexes):>12}{rows:>14}")
+    indexes = conn.execute(text(
+        "SELECT indexrelname, relname, pg_relation_size(indexrelid), idx_scan"
+        " FROM pg_stat_user_indexes ORDER BY 3 DESC"
+    )).all()
+    print(f"\n{'index':<36}{'table':<20}{'size':>12}{'scans':>12}")
+    for name, table, size, scans in indexes:
+        print(f"{name:<36}{table:<20}{human(size):>12}{scans:>12}")
+
+def _sqlite_sizes(conn):
+    try:
+        # dbstat is only available when SQLite was built with it
+        objects = conn.execute(text(
+            "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC"
+        )).all()
+    except Exception:
+        objects = None
+    print(f"{'table':<24}{'rows':>12}")
+    for table in Base.metadata.sorted_tables:
+        print(f"{table.name:<24}{conn.execute(text(f'SELECT COUNT(*) FROM {table.name}')).scalar():>12}")
+    if objects:
+        print(f"\n{'table or index':<36}{'size':>12}")
+        for name, size in objects:
+            print(f"{name:<36}{human(size):>12}")
+    page_count = conn.execute(text("PRAGMA page_count")).scalar()
+    page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    print(f"\ndatabase file: {human(page_count * page_size)}")
+
+def main():
+    args = parse_args()
+    if args.command == "archive":
+        archive(args.days, args.batch)
+    else:
+        sizes()
+
+if __name__ == "__main__":
+    main()
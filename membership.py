@@ -0,0 +1,75 @@
+# membership.py
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from config import (
+    REQUIRED_CHANNELS, MEMBERSHIP_CACHE_TTL, MEMBERSHIP_CACHE_NEGATIVE_TTL, MEMBERSHIP_CACHE_SIZE
+)
+
+ACTIVE_STATUSES = ('member', 'administrator', 'creator')
+
+class MembershipCache:
+    # LRU of user_id -> (is_member, expires_at); negative answers expire sooner
+    # so a user who just joined the channels is let in quickly.
+    def __init__(self, ttl, negative_ttl, max_size):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        is_member, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return is_member
+
+    def set(self, user_id, is_member):
+        ttl = self.ttl if is_member else self.negative_ttl
+        self._entries[user_id] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+    async def is_member(self, bot, user_id):
+        cached = self.get(user_id)
+        if cached is not None:
+            return cached
+        # Coalesce concurrent misses for the same user into one lookup
+        pending = self._inflight.get(user_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._lookup(bot, user_id))
+            self._inflight[user_id] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, bot, user_id):
+        results = await asyncio.gather(
+            *(bot.get_chat_member(chat_id=channel, user_id=user_id) for channel in REQUIRED_CHANNELS),
+            return_exceptions=True
+        )
+        if any(isinstance(result, Exception) for result in results):
+            # Don't cache API failures, just deny this once
+            return False
+        is_member = all(member.status in ACTIVE_STATUSES for member in results)
+        self.set(user_id, is_member)
+        return is_member
+
+membership_cache = MembershipCache(
+    MEMBERSHIP_CACHE_TTL, MEMBERSHIP_CACHE_NEGATIVE_TTL, MEMBERSHIP_CACHE_SIZE
+)
+
+def is_required_channel(chat):
+    if not chat.username:
+        return False
+    return f"@{chat.username}".lower() in (channel.lower() for channel in REQUIRED_CHANNELS)
@@ -0,0 +1,222 @@
+# metrics.py
+# In-process metrics rendered in the Prometheus text format at /metrics.
+# Handler callbacks, SQLAlchemy queries and Bot API requests are timed and
+# attributed to the handler that caused them through a context variable.
+
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+from telegram.request import BaseRequest
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", "0.25"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+current_handler = contextvars.ContextVar("current_handler", default="(background)")
+# Per-invocation [query count, query seconds]; shared with the DB thread pool
+# because db.run_db() copies the context into the worker thread.
+_handler_queries = contextvars.ContextVar("handler_queries", default=None)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {total}")
+        return lines
+
+class Gauge:
+    # Value is read from a callback when the metrics are scraped; with labels
+    # the callback returns {label_values: value}
+    def __init__(self, name, help, read, labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = labels
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if not self.labels:
+            return lines + [f"{self.name} {self.read()}"]
+        for values, value in sorted(self.read().items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f"{self.name}_bucket{_labels(self.labels + ('le',), values + (le,))} {cumulative}"
+                    )
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+handler_seconds = Histogram(
+    "bot_handler_duration_seconds", "Wall time spent in a handler callback", ("handler",)
+)
+handler_errors = Counter("bot_handler_errors_total", "Handler callbacks that raised", ("handler",))
+handler_queries = Histogram(
+    "bot_handler_db_queries", "DB queries issued per handler invocation", ("handler",), COUNT_BUCKETS
+)
+handler_db_seconds = Histogram(
+    "bot_handler_db_seconds", "Time spent in SQL per handler invocation", ("handler",)
+)
+db_query_seconds = Histogram(
+    "bot_db_query_duration_seconds", "Time spent executing SQL statements", ("handler",)
+)
+api_seconds = Histogram(
+    "bot_api_request_duration_seconds", "Bot API request latency", ("method", "handler")
+)
+api_errors = Counter("bot_api_errors_total", "Bot API requests that failed", ("method",))
+
+def iter_handlers(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                yield from handler.entry_points
+                for state_handlers in handler.states.values():
+                    yield from state_handlers
+                yield from handler.fallbacks
+            else:
+                yield handler
+
+def instrument_handlers(application):
+    for handler in iter_handlers(application):
+        handler.callback = _timed(handler.callback)
+
+def _timed(callback):
+    name = callback.__name__
+
+    async def wrapper(update, context):
+        handler_token = current_handler.set(name)
+        queries = [0, 0.0]
+        queries_token = _handler_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name)
+            handler_queries.observe(queries[0], name)
+            handler_db_seconds.observe(queries[1], name)
+            _handler_queries.reset(queries_token)
+            current_handler.reset(handler_token)
+    wrapper.__name__ = name
+    wrapper.__wrapped__ = callback
+    return wrapper
+
+def instrument_engine(engine):
+    if getattr(engine, "_metrics_instrumented", False):
+        return
+    engine._metrics_instrumented = True
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the per-statement context, so a statement that raises leaves
+    # nothing behind on the pooled connection
+    context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started
+    handler = current_handler.get()
+    db_query_seconds.observe(elapsed, handler)
+    queries = _handler_queries.get()
+    if queries is not None:
+        queries[0] += 1
+        queries[1] += elapsed
+    if elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning("Slow query (%.3fs) in %s: %s", elapsed, handler, " ".join(statement.split())[:500])
+
+class InstrumentedRequest(BaseRequest):
+    # Wraps the real request backend to time every Bot API call
+    def __init__(self, request):
+        self._request = request
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await self._request.do_request(url, method, request_data, **kwargs)
+        except Exception:
+            api_errors.inc(api_method)
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - started, api_method, current_handler.get())
+        if status >= 400:
+            api_errors.inc(api_method)
+        return status, payload
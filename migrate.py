@@ -0,0 +1,19 @@
+# migrate.py
+# Creates missing tables, columns and indexes and runs the backfills in
+# db.init_db(). Run it once per deploy (e.g. as the build or pre-deploy
+# command) and start the web service with AUTO_MIGRATE=0 so a cold start
+# doesn't inspect the schema before serving.
+#
+#   python migrate.py
+
+import time
+
+from db import init_db, DATABASE_URL
+
+def main():
+    started = time.perf_counter()
+    init_db()
+    print(f"Schema up to date on {DATABASE_URL.split('@')[-1]} in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
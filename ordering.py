@@ -0,0 +1,85 @@
+# ordering.py
+# Serializes updates per user while different users are processed
+# concurrently. Rapid taps from one user (double 👍, quick toggles in the
+# university picker) then run one after another in arrival order.
+
+from collections import deque
+
+from telegram import Update
+from telegram.ext import Application
+
+from metrics import Gauge
+
+class UserBacklog:
+    # key -> (update in flight, deque of updates waiting behind it). Only the
+    # update in flight is in the Application's queue, so a user's waiting
+    # updates never hold a concurrent_updates slot. An entry exists only
+    # while the user has an update in flight, so idle users cost no memory.
+    def __init__(self):
+        self._entries = {}
+
+    def admit(self, key, update):
+        # True when the update can be queued now; otherwise it waits its turn
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = (update, deque())
+            return True
+        entry[1].append(update)
+        return False
+
+    def release(self, key, update):
+        # Returns the user's next update to queue, if any
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is not update:
+            return None
+        if not entry[1]:
+            del self._entries[key]
+            return None
+        next_update = entry[1].popleft()
+        self._entries[key] = (next_update, entry[1])
+        return next_update
+
+    def waiting(self):
+        return sum(len(waiting) for _, waiting in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+user_backlog = UserBacklog()
+
+Gauge("bot_updates_waiting", "Updates queued behind an earlier update from the same user", user_backlog.waiting)
+Gauge("bot_update_keys_active", "Users with an update in progress", lambda: len(user_backlog))
+
+def update_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+class OrderedApplication(Application):
+    # Updates enter through submit() instead of update_queue.put(). The next
+    # update of a user is queued when the previous one finishes processing.
+    # admit(update) -> bool drops updates (flood control) before they wait.
+    def __init__(self, admit=None, **kwargs):
+        super().__init__(**kwargs)
+        self.admit = admit
+
+    async def submit(self, update):
+        if self.admit is not None and not self.admit(update):
+            return
+        key = update_key(update)
+        if key is None or user_backlog.admit(key, update):
+            await self.update_queue.put(update)
+
+    async def process_update(self, update):
+        try:
+            return await super().process_update(update)
+        finally:
+            key = update_key(update)
+            if key is not None:
+                next_update = user_backlog.release(key, update)
+                if next_update is not None:
+                    self.update_queue.put_nowait(next_update)
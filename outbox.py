@@ -0,0 +1,201 @@
+# outbox.py
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError
+
+from config import (
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_RATE_PER_MIN,
+    OUTBOX_WORKERS, OUTBOX_MAX_RETRIES
+)
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_RELAY = 0
+PRIORITY_MATCH = 1
+PRIORITY_NOTICE = 2
+PRIORITY_LIKE = 3
+PRIORITY_CHANNEL = 4
+PRIORITY_BULK = 9
+
+MAX_CHAT_BUCKETS = 50000
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self):
+        # Seconds until a token is available (0 when one can be taken now)
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class _Job:
+    __slots__ = ("method", "chat_id", "kwargs", "future", "attempts")
+
+    def __init__(self, method, chat_id, kwargs, future):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+class Outbox:
+    # Central queue for messages to chats other than the one being answered.
+    # Jobs go out in priority order under a global token bucket plus one
+    # bucket per chat; RetryAfter pauses the chat and requeues the job.
+    def __init__(self, global_rate, chat_rate, chat_burst, group_rate_per_min, workers, max_retries):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_min / 60
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = OrderedDict()
+        self._queue = None
+        self._seq = itertools.count()
+        self._tasks = []
+        self.bot = None
+
+    def start(self, bot):
+        self.bot = bot
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbox stopped with %d messages unsent", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue else 0
+
+    def send_message(self, chat_id, text, priority, **kwargs):
+        return self.enqueue("send_message", chat_id, priority, text=text, **kwargs)
+
+    def send_photo(self, chat_id, photo, priority, **kwargs):
+        return self.enqueue("send_photo", chat_id, priority, photo=photo, **kwargs)
+
+    def enqueue(self, method, chat_id, priority, **kwargs):
+        # Returns a future with the sent Message; callers may ignore it
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        self._put(priority, next(self._seq), _Job(method, chat_id, kwargs, future))
+        return future
+
+    def _put(self, priority, seq, job):
+        self._queue.put_nowait((priority, seq, job))
+
+    def _requeue_later(self, delay, entry):
+        # The job stays unfinished while it waits, so stop() still drains it
+        asyncio.get_running_loop().call_later(delay, self._requeue, entry)
+
+    def _requeue(self, entry):
+        self._put(*entry)
+        self._queue.task_done()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, str) or chat_id < 0:
+                # Channels and groups
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            entry = await self._queue.get()
+            priority, seq, job = entry
+            if job.future.cancelled():
+                self._queue.task_done()
+                continue
+            chat_bucket = self._chat_bucket(job.chat_id)
+            wait = chat_bucket.wait_time()
+            if wait > 0:
+                # Don't hold up other chats behind a throttled one
+                self._requeue_later(wait, entry)
+                continue
+            chat_bucket.take()
+            wait = self._global.wait_time()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._global.wait_time()
+            self._global.take()
+            await self._send(entry, chat_bucket)
+
+    async def _send(self, entry, chat_bucket):
+        priority, seq, job = entry
+        job.attempts += 1
+        try:
+            result = await getattr(self.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except RetryAfter as exc:
+            chat_bucket.pause(exc.retry_after)
+            if job.attempts <= self.max_retries:
+                self._requeue_later(exc.retry_after, entry)
+                return
+            job.future.set_exception(exc)
+        except (Forbidden, BadRequest) as exc:
+            # Permanent: blocked bot, deleted chat, bad payload
+            job.future.set_exception(exc)
+        except NetworkError as exc:
+            if job.attempts <= self.max_retries:
+                self._requeue_later(min(2 ** job.attempts, 30), entry)
+                return
+            job.future.set_exception(exc)
+        except Exception as exc:
+            job.future.set_exception(exc)
+        else:
+            job.future.set_result(result)
+        self._queue.task_done()
+
+    @staticmethod
+    def _log_failure(future):
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if isinstance(exc, Forbidden):
+            logger.info("Message not delivered: %s", exc)
+        elif exc:
+            logger.error("Message dropped", exc_info=exc)
+
+outbox = Outbox(
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_GROUP_RATE_PER_MIN,
+    OUTBOX_WORKERS, OUTBOX_MAX_RETRIES
+)
+
+Gauge("bot_outbox_queued", "Messages waiting in the outbox", outbox.qsize)
@@ -0,0 +1,147 @@
+# persistence.py
+
+import asyncio
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import run_db
+import queries
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user"
+CONVERSATION = "conv:"
+
+def encode(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob))
+
+class DatabasePersistence(BasePersistence):
+    # Stores user_data and ConversationHandler states in the bot_state table
+    # as zlib-compressed JSON. PTB hands over changed state every
+    # update_interval seconds; each round is written in one transaction.
+    # Conversations untouched for conversation_ttl and user_data untouched for
+    # user_data_ttl are not loaded and are purged from the table. With shared,
+    # user_data written by another worker is reloaded before each update.
+    def __init__(self, update_interval, conversation_ttl, user_data_ttl, shared=False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.conversation_ttl = conversation_ttl
+        self.user_data_ttl = user_data_ttl
+        self.shared = shared
+        self._loaded_at = None
+        self._synced = {}        # user_id -> updated_at of the row this worker last wrote
+        self._dirty = {}
+        self._write_scheduled = False
+        self._writes = set()
+        self._last_purge = None
+
+    async def get_user_data(self):
+        self._loaded_at = datetime.utcnow()
+        cutoff = self._loaded_at - self.user_data_ttl
+        rows = await run_db(queries.load_state, USER_DATA, cutoff)
+        return {int(key): decode(data) for key, data in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        cutoff = datetime.utcnow() - self.conversation_ttl
+        rows = await run_db(queries.load_state, CONVERSATION + name, cutoff)
+        return {tuple(json.loads(key)): decode(data) for key, data in rows}
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(CONVERSATION + name, json.dumps(list(key)), None if new_state is None else encode(new_state))
+
+    async def update_user_data(self, user_id, data):
+        self._mark(USER_DATA, str(user_id), encode(data) if data else None)
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._mark(USER_DATA, str(user_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        if not self.shared or (USER_DATA, str(user_id)) in self._dirty:
+            return
+        row = await run_db(queries.load_state_row, USER_DATA, str(user_id))
+        if row is None or row.updated_at <= self._synced.get(user_id, self._loaded_at):
+            # Nothing newer than this worker's copy, which may hold changes
+            # PTB hasn't handed over yet
+            return
+        self._synced[user_id] = row.updated_at
+        user_data.clear()
+        user_data.update(decode(row.data))
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        await self._write()
+
+    def _mark(self, kind, key, payload):
+        # payload None deletes the row
+        self._dirty[(kind, key)] = payload
+        if not self._write_scheduled:
+            # PTB calls update_* for a whole round before yielding; write after it
+            self._write_scheduled = True
+            asyncio.get_running_loop().call_soon(self._start_write)
+
+    def _start_write(self):
+        self._write_scheduled = False
+        task = asyncio.ensure_future(self._write())
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self):
+        batch, self._dirty = self._dirty, {}
+        now = datetime.utcnow()
+        purge = self._last_purge is None or now - self._last_purge > timedelta(hours=1)
+        if not batch and not purge:
+            return
+        try:
+            await run_db(
+                queries.save_state, batch, now,
+                {CONVERSATION: now - self.conversation_ttl, USER_DATA: now - self.user_data_ttl} if purge else None
+            )
+        except Exception:
+            logger.exception("Failed to persist bot state; will retry")
+            # Keep anything that changed again meanwhile, retry the rest
+            for item, payload in batch.items():
+                self._dirty.setdefault(item, payload)
+            return
+        if self.shared:
+            for kind, key in batch:
+                if kind == USER_DATA:
+                    self._synced[int(key)] = now
+        if purge:
+            self._last_purge = now
@@ -0,0 +1,125 @@
+# publisher.py
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from config import CONFESSION_CHANNEL_ID, CONFESSION_RATE_PER_MIN
+from db import run_db
+import queries
+from outbox import outbox, PRIORITY_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+POLL_INTERVAL = 30
+CLAIM_TIMEOUT = timedelta(minutes=10)
+FINISH_RETRY_FOR = CLAIM_TIMEOUT / 2
+
+class ConfessionPublisher:
+    # Drains approved confessions into the channel at rate_per_min, oldest
+    # first. Each item is claimed with a compare-and-set before sending, so
+    # several workers can run a publisher without posting anything twice.
+    # Claims older than CLAIM_TIMEOUT belong to a publisher that died and go
+    # back to approved. notify() wakes it when this worker approves
+    # something; otherwise it polls every POLL_INTERVAL seconds for items
+    # queued elsewhere.
+    def __init__(self, channel_id, rate_per_min):
+        self.channel_id = channel_id
+        self.interval = 60 / rate_per_min
+        self._wake = None
+        self._task = None
+        self._publishing = None
+
+    async def start(self):
+        await self._release_stale()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        # Let a post already handed to the outbox be recorded as posted
+        if self._publishing is not None:
+            await asyncio.gather(self._publishing, return_exceptions=True)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wake.clear()
+            try:
+                items = await run_db(queries.approved_confessions, BATCH_SIZE)
+            except Exception:
+                logger.exception("Failed to load queued confessions")
+                items = []
+            if not items:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    await self._release_stale()
+                continue
+            for confession_id, text in items:
+                started = loop.time()
+                self._publishing = asyncio.ensure_future(self._publish(confession_id, text))
+                try:
+                    await asyncio.shield(self._publishing)
+                except Exception:
+                    logger.exception("Failed to publish confession %s", confession_id)
+                self._publishing = None
+                await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+
+    async def _release_stale(self):
+        try:
+            released = await run_db(queries.release_publishing, datetime.utcnow() - CLAIM_TIMEOUT)
+        except Exception:
+            logger.exception("Failed to release stale confession claims")
+            return
+        if released:
+            logger.warning("Released %d stale confession claims", released)
+
+    async def _publish(self, confession_id, text):
+        try:
+            if not await run_db(queries.set_confession_status, confession_id, "approved", "publishing"):
+                return
+        except Exception:
+            logger.exception("Failed to claim confession %s", confession_id)
+            return
+        try:
+            await outbox.send_message(
+                self.channel_id,
+                f"📩 **New Confession:**\n\n{text}",
+                PRIORITY_CHANNEL,
+                parse_mode="Markdown"
+            )
+        except Exception:
+            logger.exception("Failed to post confession %s", confession_id)
+            await self._finish(confession_id, "failed")
+            return
+        await self._finish(confession_id, "posted")
+
+    async def _finish(self, confession_id, status):
+        # Retried while the claim is fresh: a posted item left in publishing
+        # would be released after CLAIM_TIMEOUT and posted a second time
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + FINISH_RETRY_FOR.total_seconds()
+        delay = 1
+        while True:
+            try:
+                await run_db(queries.set_confession_status, confession_id, "publishing", status)
+                return
+            except Exception:
+                if loop.time() + delay > deadline:
+                    logger.exception("Gave up marking confession %s as %s", confession_id, status)
+                    return
+                logger.warning("Failed to mark confession %s as %s; retrying", confession_id, status, exc_info=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+confession_publisher = ConfessionPublisher(CONFESSION_CHANNEL_ID, CONFESSION_RATE_PER_MIN)
@@ -0,0 +1,346 @@
+# queries.py
+# Blocking data access used by the handlers. Every function takes the session
+# as its first argument and is meant to be called through db.run_db().
+
+from datetime import datetime
+from sqlalchemy import update, delete, exists, tuple_, func, select, literal, or_
+from sqlalchemy.orm import aliased
+from db import (
+    User, Like, Skip, LikeArchive, SkipArchive, BotState, FloodBlock, Confession, Broadcast, insert_ignore, upsert,
+    epoch_seconds, lock_pairs
+)
+from universities import university_bit, selection_mask, mask_bits, ALL_MASK
+from ranking import interest_bits
+
+def get_user(session, tg_id):
+    return session.query(User).filter_by(tg_id=tg_id).first()
+
+def save_profile(session, tg_id, data):
+    db_user = get_user(session, tg_id)
+    if not db_user:
+        db_user = User(tg_id=tg_id)
+        session.add(db_user)
+    db_user.name = data['name']
+    db_user.university = data['university']
+    db_user.age = data['age']
+    db_user.gender = data['gender']
+    db_user.interests = data['interests']
+    db_user.bio = data['bio']
+    db_user.looking_for = data['looking_for']
+    db_user.photo_file_id = data['photo_file_id']
+    db_user.registered = True
+    db_user.match_universities = ",".join(data['looking_for_unis'])
+    db_user.university_bit = university_bit(db_user.university)
+    db_user.match_uni_mask = selection_mask(data['looking_for_unis'])
+    db_user.interest_bits = interest_bits(db_user.interests)
+    db_user.profile_updated_at = datetime.utcnow()
+    db_user.blocked = False
+    return db_user
+
+def candidate_pool(session, tg_id, after_id=0, limit=1000):
+    # Returns (user, rows): the next `limit` matching profiles with
+    # id > after_id, in id order (after_id is the keyset cursor). Rows only
+    # carry what ranking needs; load the winners with users_by_ids().
+    db_user = get_user(session, tg_id)
+    if not db_user or not db_user.registered:
+        return None, []
+
+    # Exclude already liked/skipped users with anti-joins instead of a NOT IN list
+    already_liked = session.query(Like.id).filter(
+        Like.from_user_id == db_user.id,
+        Like.to_user_id == User.id
+    ).exists()
+    already_skipped = session.query(Skip.id).filter(
+        Skip.from_user_id == db_user.id,
+        Skip.to_user_id == User.id
+    ).exists()
+    match_query = session.query(
+        User.id, User.interest_bits, func.coalesce(epoch_seconds(User.profile_updated_at), 0.0).label("updated_epoch")
+    ).filter(
+        User.registered == True,
+        User.gender == db_user.looking_for,
+        User.id != db_user.id,
+        User.id > after_id,
+        # The candidate must also want someone from the user's university
+        User.match_uni_mask.op('&')(db_user.university_bit) != 0,
+        ~already_liked,
+        ~already_skipped
+    )
+    if db_user.match_uni_mask != ALL_MASK:
+        match_query = match_query.filter(User.university_bit.in_(mask_bits(db_user.match_uni_mask)))
+    return db_user, match_query.order_by(User.id).limit(limit).all()
+
+def users_by_ids(session, ids):
+    # Registered users for ids, in the order given
+    users = {user.id: user for user in session.query(User).filter(User.id.in_(ids), User.registered == True)}
+    return [users[user_id] for user_id in ids if user_id in users]
+
+def swipe_parties(session, tg_id, target_id):
+    # Returns (user, target) for a swipe that isn't in the candidate buffer
+    db_user = get_user(session, tg_id)
+    return db_user, session.query(User).filter_by(id=target_id).first()
+
+def record_swipe(session, from_user_id, to_user_id, liked):
+    # Returns True when this like completed a match
+    return (from_user_id, to_user_id) in record_swipes(session, [(from_user_id, to_user_id, liked)])
+
+def record_swipes(session, swipes):
+    # Stores (from_user_id, to_user_id, liked) tuples and marks mutual likes
+    # as matched. Returns the (from, to) likes that completed a new match;
+    # when both likes of a pair are in this batch, only the later one.
+    now = datetime.utcnow()
+    likes = [{"from_user_id": f, "to_user_id": t, "timestamp": now} for f, t, liked in swipes if liked]
+    skips = [{"from_user_id": f, "to_user_id": t, "timestamp": now} for f, t, liked in swipes if not liked]
+    if skips:
+        session.execute(insert_ignore(Skip.__table__), skips)
+    if not likes:
+        return set()
+    pairs = {(like["from_user_id"], like["to_user_id"]) for like in likes}
+    # A->B and B->A committed side by side would each miss the other's
+    # insert under READ COMMITTED; serialize them per pair instead
+    lock_pairs(session, pairs)
+    session.execute(insert_ignore(Like.__table__), likes)
+
+    # One statement both finds reverse likes and flags the pair as matched
+    likes_table = Like.__table__
+    reverse = likes_table.alias("reverse")
+    both_ways = list(pairs) + [(t, f) for f, t in pairs]
+    matched = session.execute(
+        update(likes_table)
+        .where(
+            tuple_(likes_table.c.from_user_id, likes_table.c.to_user_id).in_(both_ways),
+            likes_table.c.matched == False,
+            exists().where(
+                reverse.c.from_user_id == likes_table.c.to_user_id,
+                reverse.c.to_user_id == likes_table.c.from_user_id
+            )
+        )
+        .values(matched=True, matched_at=func.coalesce(likes_table.c.matched_at, now))
+        .returning(likes_table.c.from_user_id, likes_table.c.to_user_id)
+    ).all()
+    order = {(f, t): i for i, (f, t, liked) in enumerate(swipes) if liked}
+    return {
+        (f, t) for f, t in (tuple(row) for row in matched)
+        if (f, t) in order and order.get((t, f), -1) < order[(f, t)]
+    }
+
+def list_matches(session, tg_id, cursor=None, newer=False, limit=10):
+    # One page of matches, newest first, as rows of (like id, matched_at,
+    # tg_id, name, university). cursor is the (matched_at, like id) keyset
+    # position to continue from: older than it, or newer when newer=True.
+    # Returns (registered, rows, has_more) where has_more says whether the
+    # page could continue further in the same direction.
+    owner = aliased(User)
+    query = session.query(Like.id, Like.matched_at, User.tg_id, User.name, User.university).join(
+        owner, owner.id == Like.from_user_id
+    ).join(
+        User, User.id == Like.to_user_id
+    ).filter(owner.tg_id == tg_id, Like.matched == True, Like.matched_at.isnot(None))
+    position = tuple_(Like.matched_at, Like.id)
+    if newer:
+        if cursor is not None:
+            query = query.filter(position > tuple_(*cursor))
+        query = query.order_by(Like.matched_at, Like.id)
+    else:
+        if cursor is not None:
+            query = query.filter(position < tuple_(*cursor))
+        query = query.order_by(Like.matched_at.desc(), Like.id.desc())
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    if not rows and cursor is None:
+        return get_user(session, tg_id) is not None, [], False
+    return True, rows, has_more
+
+def open_chat(session, tg_id, target_tg_id):
+    db_user = get_user(session, tg_id)
+    target_user = get_user(session, target_tg_id)
+    if not target_user:
+        return None
+    db_user.chatting_with = target_user.tg_id
+    target_user.chatting_with = db_user.tg_id
+    return target_user
+
+def active_chats(session):
+    return session.query(User.tg_id, User.chatting_with).filter(User.chatting_with != None).all()
+
+def leave_chat(session, tg_id):
+    session.query(User).filter_by(tg_id=tg_id).update({User.chatting_with: None})
+
+def close_chat(session, tg_id):
+    # Returns (was_chatting, partner_tg_id)
+    db_user = get_user(session, tg_id)
+    if not db_user or not db_user.chatting_with:
+        return False, None
+    target_user = get_user(session, db_user.chatting_with)
+    partner_tg_id = None
+    if target_user:
+        target_user.chatting_with = None
+        partner_tg_id = target_user.tg_id
+    db_user.chatting_with = None
+    return True, partner_tg_id
+
+def load_state(session, kind, updated_since):
+    return session.query(BotState.key, BotState.data).filter(
+        BotState.kind == kind,
+        BotState.updated_at >= updated_since
+    ).all()
+
+def load_state_row(session, kind, key):
+    return session.query(BotState.data, BotState.updated_at).filter(
+        BotState.kind == kind,
+        BotState.key == key
+    ).one_or_none()
+
+def save_state(session, items, now, purge_before=None):
+    # items: {(kind, key): data or None to delete}. purge_before maps a kind
+    # prefix to the cutoff before which rows of that kind are deleted.
+    removed = [item for item, data in items.items() if data is None]
+    stored = [
+        {"kind": kind, "key": key, "data": data, "updated_at": now}
+        for (kind, key), data in items.items() if data is not None
+    ]
+    if removed:
+        session.execute(
+            delete(BotState).where(tuple_(BotState.kind, BotState.key).in_(removed)),
+            execution_options={"synchronize_session": False}
+        )
+    if stored:
+        session.execute(upsert(BotState.__table__, ["kind", "key"]), stored)
+    for prefix, cutoff in (purge_before or {}).items():
+        session.execute(
+            delete(BotState).where(BotState.kind.startswith(prefix), BotState.updated_at < cutoff),
+            execution_options={"synchronize_session": False}
+        )
+
+def sync_flood_blocks(session, blocks, now):
+    # Stores this worker's new blocks ({tg_id: until}) and returns every
+    # block still active, from all workers.
+    if blocks:
+        session.execute(
+            upsert(FloodBlock.__table__, ["tg_id"]),
+            [{"tg_id": tg_id, "until": until} for tg_id, until in blocks.items()]
+        )
+    session.query(FloodBlock).filter(FloodBlock.until < now).delete(synchronize_session=False)
+    return session.query(FloodBlock.tg_id, FloodBlock.until).all()
+
+def enqueue_confession(session, text, text_hash, status, duplicate_since):
+    # Returns the new confession id, or None when the same text (by hash) was
+    # submitted after duplicate_since and wasn't rejected.
+    duplicate = session.query(Confession.id).filter(
+        Confession.text_hash == text_hash,
+        Confession.created_at >= duplicate_since,
+        Confession.status != "rejected"
+    ).first()
+    if duplicate:
+        return None
+    confession = Confession(text=text, text_hash=text_hash, status=status)
+    session.add(confession)
+    session.flush()
+    return confession.id
+
+def set_confession_status(session, confession_id, from_status, to_status):
+    # Compare-and-set, so two moderators or two publishers can't both act
+    values = {Confession.status: to_status}
+    if to_status == "publishing":
+        values[Confession.claimed_at] = datetime.utcnow()
+    if to_status == "posted":
+        values[Confession.posted_at] = datetime.utcnow()
+    return session.query(Confession).filter(
+        Confession.id == confession_id, Confession.status == from_status
+    ).update(values, synchronize_session=False) == 1
+
+def approved_confessions(session, limit):
+    return session.query(Confession.id, Confession.text).filter(
+        Confession.status == "approved"
+    ).order_by(Confession.id).limit(limit).all()
+
+def release_publishing(session, claimed_before):
+    # Items claimed before claimed_before by a publisher that stopped before
+    # finishing them; newer claims may still be in flight on another worker
+    return session.query(Confession).filter(
+        Confession.status == "publishing",
+        or_(Confession.claimed_at < claimed_before, Confession.claimed_at.is_(None))
+    ).update({Confession.status: "approved"}, synchronize_session=False)
+
+def unmatched_like_counts(session, user_ids, since):
+    # {users.id: likes received since `since` that aren't matches yet}
+    return dict(session.query(Like.to_user_id, func.count(Like.id)).filter(
+        Like.to_user_id.in_(user_ids),
+        Like.timestamp >= since,
+        Like.matched == False
+    ).group_by(Like.to_user_id).all())
+
+def _broadcast_recipients(session, *columns):
+    return session.query(*columns).filter(User.registered == True, User.blocked.isnot(True))
+
+def create_broadcast(session, text, admin_tg_id):
+    broadcast = Broadcast(
+        text=text, admin_tg_id=admin_tg_id, status="running",
+        total=_broadcast_recipients(session, User.id).count()
+    )
+    session.add(broadcast)
+    session.flush()
+    return broadcast
+
+def running_broadcasts(session):
+    return session.query(Broadcast).filter(Broadcast.status == "running").order_by(Broadcast.id).all()
+
+def broadcast_chunk(session, after_id, limit):
+    # Next (users.id, tg_id) keyset page of recipients
+    return _broadcast_recipients(session, User.id, User.tg_id).filter(
+        User.id > after_id
+    ).order_by(User.id).limit(limit).all()
+
+def save_broadcast_progress(session, broadcast_id, previous_id, last_id, sent, blocked, failed, blocked_ids, done):
+    # Advances the checkpoint only if it is still where this worker left it
+    # and the broadcast wasn't cancelled; returns False otherwise.
+    values = {
+        Broadcast.last_user_id: last_id,
+        Broadcast.sent: Broadcast.sent + sent,
+        Broadcast.blocked: Broadcast.blocked + blocked,
+        Broadcast.failed: Broadcast.failed + failed,
+    }
+    if done:
+        values[Broadcast.status] = "done"
+        values[Broadcast.finished_at] = datetime.utcnow()
+    advanced = session.query(Broadcast).filter(
+        Broadcast.id == broadcast_id, Broadcast.status == "running", Broadcast.last_user_id == previous_id
+    ).update(values, synchronize_session=False) == 1
+    if advanced and blocked_ids:
+        session.query(User).filter(User.id.in_(blocked_ids)).update(
+            {User.blocked: True}, synchronize_session=False
+        )
+    return advanced
+
+def cancel_broadcast(session, broadcast_id):
+    return session.query(Broadcast).filter(
+        Broadcast.id == broadcast_id, Broadcast.status == "running"
+    ).update({Broadcast.status: "cancelled", Broadcast.finished_at: datetime.utcnow()}, synchronize_session=False) == 1
+
+def unblock_user(session, tg_id):
+    session.query(User).filter(User.tg_id == tg_id, User.blocked == True).update(
+        {User.blocked: False}, synchronize_session=False
+    )
+
+def archive_swipes(session, liked, cutoff, limit):
+    # Moves up to `limit` unmatched likes (or skips) older than cutoff into
+    # the archive table; returns how many were moved.
+    if liked:
+        model, archive = Like, LikeArchive
+        expired = session.query(Like.id).filter(Like.matched == False, Like.timestamp < cutoff)
+    else:
+        model, archive = Skip, SkipArchive
+        expired = session.query(Skip.id).filter(Skip.timestamp < cutoff)
+    ids = [row.id for row in expired.order_by(model.timestamp).limit(limit)]
+    if not ids:
+        return 0
+    now = datetime.utcnow()
+    session.execute(insert_ignore(archive.__table__).from_select(
+        ["id", "from_user_id", "to_user_id", "timestamp", "archived_at"],
+        select(model.id, model.from_user_id, model.to_user_id, model.timestamp, literal(now)).where(model.id.in_(ids))
+    ))
+    session.execute(delete(model).where(model.id.in_(ids)), execution_options={"synchronize_session": False})
+    return len(ids)
@@ -0,0 +1,64 @@
+# ranking.py
+# Interest similarity ranking for browse candidates. Free-text interests are
+# tokenized and hashed into a fixed 256-bit vocabulary; each user's bits are
+# stored on users.interest_bits when the profile is saved, and a pool of
+# candidates is scored in one vectorized pass (Jaccard + recency boost).
+
+import re
+import time
+import zlib
+
+import numpy as np
+
+from config import RANK_RECENCY_WEIGHT, RANK_RECENCY_DAYS
+
+VECTOR_BITS = 256
+VECTOR_BYTES = VECTOR_BITS // 8
+
+STOPWORDS = {"and", "the", "to", "of", "in", "on", "for", "with", "my", "me", "i", "a", "an", "etc"}
+_SPLIT = re.compile(r"[^\w]+")
+
+def _popcount_rows(words):
+    # Set bits per row of a (n, VECTOR_BYTES // 8) uint64 array
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return np.unpackbits(words.view(np.uint8), axis=1).sum(axis=1, dtype=np.int32)
+
+def interest_tokens(text):
+    tokens = set()
+    for token in _SPLIT.split((text or "").lower()):
+        if len(token) < 2 or token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.add(token)
+    return tokens
+
+def interest_bits(text):
+    vector = bytearray(VECTOR_BYTES)
+    for token in interest_tokens(text):
+        bit = zlib.crc32(token.encode()) % VECTOR_BITS
+        vector[bit // 8] |= 1 << (bit % 8)
+    return bytes(vector)
+
+def rank_candidates(user_bits, pool):
+    # pool: (id, interest_bits, updated_epoch) rows in id order, updated_epoch
+    # being profile_updated_at as UTC seconds (0 if unset). Returns candidate
+    # ids best first; ties keep id order.
+    if not pool:
+        return []
+    ids, bits, updated = zip(*pool)
+    empty = bytes(VECTOR_BYTES)
+    if None in bits:
+        bits = [value or empty for value in bits]
+    matrix = np.frombuffer(b"".join(bits), dtype=np.uint64).reshape(len(pool), VECTOR_BYTES // 8)
+    mine = np.frombuffer(user_bits or empty, dtype=np.uint64)
+
+    shared = _popcount_rows(matrix & mine)
+    either = _popcount_rows(matrix | mine)
+    scores = shared / np.maximum(either, 1)
+
+    age_days = (time.time() - np.array(updated, dtype=np.float64)) / 86400
+    scores += RANK_RECENCY_WEIGHT * np.exp(-np.maximum(age_days, 0) / RANK_RECENCY_DAYS)
+
+    return np.array(ids, dtype=np.int64)[np.argsort(-scores, kind="stable")].tolist()
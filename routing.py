@@ -0,0 +1,36 @@
+# routing.py
+
+from metrics import Gauge
+
+class ChatRoutes:
+    # In-process mirror of users.chatting_with (tg_id -> partner tg_id) so
+    # relayed messages need no DB work. The DB stays the source of truth and
+    # is written first; this map is reloaded from it at startup.
+    def __init__(self):
+        self._partners = {}
+
+    def load(self, pairs):
+        self._partners = dict(pairs)
+
+    def partner(self, tg_id):
+        return self._partners.get(tg_id)
+
+    def connect(self, tg_id, partner_tg_id):
+        self._partners[tg_id] = partner_tg_id
+        self._partners[partner_tg_id] = tg_id
+
+    def leave(self, tg_id):
+        self._partners.pop(tg_id, None)
+
+    def close(self, tg_id):
+        partner_tg_id = self._partners.pop(tg_id, None)
+        if partner_tg_id is not None:
+            self._partners.pop(partner_tg_id, None)
+        return partner_tg_id
+
+    def __len__(self):
+        return len(self._partners)
+
+chat_routes = ChatRoutes()
+
+Gauge("bot_chat_routes", "Users in an anonymous chat, as cached by this worker", lambda: len(chat_routes))
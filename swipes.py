@@ -0,0 +1,70 @@
+# swipes.py
+
+import asyncio
+import logging
+
+from config import SWIPE_FLUSH_INTERVAL, SWIPE_FLUSH_MAX_BATCH
+from db import run_db
+import queries
+
+logger = logging.getLogger(__name__)
+
+class SwipeWriter:
+    # Write-behind buffer for likes/skips. With a zero flush interval every
+    # swipe is written straight away; otherwise swipes are collected and
+    # stored in one transaction per interval. Skips return immediately, likes
+    # wait for the flush that tells them whether they made a match.
+    def __init__(self, flush_interval, max_batch):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+
+    async def record(self, from_user_id, to_user_id, liked):
+        if self.flush_interval <= 0:
+            return await run_db(queries.record_swipe, from_user_id, to_user_id, liked)
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._log_failure)
+        self._pending.append((from_user_id, to_user_id, liked, future))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+        if not liked:
+            return False
+        return await asyncio.shield(future)
+
+    async def close(self):
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        try:
+            matched = await run_db(queries.record_swipes, [(f, t, liked) for f, t, liked, _ in batch])
+        except Exception as exc:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for from_user_id, to_user_id, liked, future in batch:
+            if not future.done():
+                future.set_result((from_user_id, to_user_id) in matched)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception():
+            logger.error("Failed to store swipe", exc_info=future.exception())
+
+swipe_writer = SwipeWriter(SWIPE_FLUSH_INTERVAL, SWIPE_FLUSH_MAX_BATCH)
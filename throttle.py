@@ -0,0 +1,170 @@
+# throttle.py
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from config import (
+    FLOOD_LIMITS, FLOOD_BLOCK_AFTER, FLOOD_BLOCK_SECONDS, FLOOD_SHARED, FLOOD_SYNC_INTERVAL, FLOOD_MAX_KEYS
+)
+from db import run_db
+import queries
+from outbox import TokenBucket
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+BROWSE_COMMANDS = {"/browse"}
+BROWSE_BUTTONS = {"👍 Like", "⏭️ Skip"}
+MATCHES_COMMANDS = {"/matches"}
+
+throttled = Counter("bot_updates_throttled_total", "Updates dropped by the flood guard", ("kind",))
+
+def parse_limits(spec):
+    # "browse=1/10,relay=2/10" -> {"browse": (1.0, 10.0), "relay": (2.0, 10.0)}
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        limits[kind.strip()] = (float(rate), float(burst or 1))
+    return limits
+
+def update_kind(update):
+    if update.callback_query is not None:
+        return "callback"
+    message = update.message
+    if message is None:
+        return None
+    text = message.text or ""
+    if text.startswith("/"):
+        command = text.split(maxsplit=1)[0].split("@", 1)[0]
+        if command in BROWSE_COMMANDS:
+            return "browse"
+        if command in MATCHES_COMMANDS:
+            return "matches"
+        return "command"
+    if text in BROWSE_BUTTONS:
+        return "browse"
+    return "relay"
+
+class FloodGuard:
+    # Token bucket per (user, kind), checked as an update is submitted, before
+    # it is queued or takes a concurrent_updates slot. Buckets live in an LRU
+    # ordered by last use; a bucket idle long enough to be full again is
+    # indistinguishable from a new one, so it is evicted from the front.
+    def __init__(self, limits, block_after, block_seconds, max_keys, shared=False, sync_interval=5):
+        self.limits = limits
+        self.block_after = block_after
+        self.block_seconds = block_seconds
+        self.max_keys = max_keys
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self.idle_ttl = max((burst / rate for rate, burst in limits.values()), default=0)
+        self._buckets = OrderedDict()
+        self._blocked = {}       # tg_id -> wall-clock time the mute ends
+        self._new_blocks = {}    # mutes not yet written to the DB
+        self._task = None
+
+    def allow(self, update):
+        user = update.effective_user
+        if user is None:
+            return True
+        kind = update_kind(update)
+        if kind is None:
+            return True
+        now = time.time()
+        until = self._blocked.get(user.id)
+        if until is not None:
+            if until > now:
+                throttled.inc(kind)
+                return False
+            del self._blocked[user.id]
+        if kind not in self.limits and "default" not in self.limits:
+            return True
+        bucket = self._bucket((user.id, kind), kind)
+        if bucket.wait_time() == 0:
+            bucket.take()
+            bucket.dropped = 0
+            return True
+        bucket.dropped += 1
+        throttled.inc(kind)
+        if self.block_after and bucket.dropped >= self.block_after:
+            self.block(user.id, now + self.block_seconds)
+        return False
+
+    def block(self, tg_id, until):
+        logger.info("Muting %s for flooding until %s", tg_id, datetime.utcfromtimestamp(until))
+        self._blocked[tg_id] = until
+        if len(self._blocked) > self.max_keys:
+            now = time.time()
+            self._blocked = {key: end for key, end in self._blocked.items() if end > now}
+        if self.shared:
+            self._new_blocks[tg_id] = until
+
+    def _bucket(self, key, kind):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+        rate, burst = self.limits.get(kind) or self.limits["default"]
+        bucket = self._buckets[key] = TokenBucket(rate, burst)
+        bucket.dropped = 0
+        self._evict()
+        return bucket
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if oldest.updated >= cutoff and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+    def start(self):
+        if self.shared and self._task is None:
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await self._sync()
+        except Exception:
+            logger.exception("Failed to sync flood blocks")
+
+    async def _sync_loop(self):
+        while True:
+            try:
+                await self._sync()
+            except Exception:
+                logger.exception("Failed to sync flood blocks")
+            await asyncio.sleep(self.sync_interval)
+
+    async def _sync(self):
+        pending, self._new_blocks = self._new_blocks, {}
+        now = time.time()
+        try:
+            rows = await run_db(
+                queries.sync_flood_blocks,
+                {tg_id: datetime.utcfromtimestamp(until) for tg_id, until in pending.items()},
+                datetime.utcfromtimestamp(now)
+            )
+        except Exception:
+            for tg_id, until in pending.items():
+                self._new_blocks.setdefault(tg_id, until)
+            raise
+        # Mutes from other workers replace the local map; expired ones are gone
+        blocked = {tg_id: until for tg_id, until in self._blocked.items() if until > now}
+        for tg_id, until in rows:
+            blocked[tg_id] = max(blocked.get(tg_id, 0), (until - datetime(1970, 1, 1)).total_seconds())
+        self._blocked = blocked
+
+flood_guard = FloodGuard(
+    parse_limits(FLOOD_LIMITS), FLOOD_BLOCK_AFTER, FLOOD_BLOCK_SECONDS, FLOOD_MAX_KEYS,
+    FLOOD_SHARED, FLOOD_SYNC_INTERVAL
+)
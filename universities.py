@@ -0,0 +1,28 @@
+# universities.py
+# Compact integer form of config.UNIVERSITIES used for filtering in SQL.
+# Bit positions follow list order, so new universities must be appended to
+# the end of config.UNIVERSITIES, never inserted or reordered.
+
+from config import UNIVERSITIES
+
+ALL_UNIVERSITIES = "All Universities"
+OTHER_UNIVERSITY = "Other"
+
+UNIVERSITY_BITS = {name: 1 << index for index, name in enumerate(UNIVERSITIES)}
+UNIVERSITY_BITS[OTHER_UNIVERSITY] = 1 << len(UNIVERSITIES)
+ALL_MASK = (1 << (len(UNIVERSITIES) + 1)) - 1
+
+def university_bit(name):
+    return UNIVERSITY_BITS.get(name, UNIVERSITY_BITS[OTHER_UNIVERSITY])
+
+def selection_mask(names):
+    if ALL_UNIVERSITIES in names:
+        return ALL_MASK
+    mask = 0
+    for name in names:
+        mask |= UNIVERSITY_BITS.get(name, 0)
+    return mask
+
+def mask_bits(mask):
+    # Single-bit values set in mask, for sargable `university_bit IN (...)` filters
+    return [bit for bit in UNIVERSITY_BITS.values() if mask & bit]